@@ -0,0 +1,186 @@
+import argparse
+import gzip
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import db
+import functions as func
+import metrics
+import notify
+import scheduler
+import snapshot
+
+_bodies_lock = threading.Lock()
+_bodies_generation = None
+# (source id, platform filter, filtered) -> (etag, body, gzipped body); rebuilt only when the snapshot generation moves on
+_bodies = {}
+# Stands in for a source id to ask for the latest vs lagging matrix; no path segment can be equal to it
+MATRIX = ("matrix",)
+
+
+def record_dict(record, versions):
+    standing = versions.standings.get(record.id)
+    return {**record._asdict(), "healthy": record.healthy, "stale": record.stale,
+            "paused_until": versions.paused.get(record.id),
+            "latest": standing.latest if standing else None,
+            "lagging": standing.lagging if standing else None}
+
+
+def build_body(versions, source_id=None, platforms=(), filtered=False):
+    if source_id == MATRIX:
+        document = {"generation": versions.generation, "groups": versions.matrix}
+    elif source_id is not None:
+        record = versions.by_id.get(source_id)
+        if record is None:
+            return None
+        document = record_dict(record, versions)
+        regions = versions.source_regions(source_id)
+        if regions:
+            document["regions"] = [{**region._asdict(), "healthy": region.healthy} for region in regions]
+    else:
+        records = versions.records
+        if filtered:
+            records = [record for platform in platforms for record in versions.platform(platform)]
+        document = {"generation": versions.generation,
+                    "versions": [record_dict(record, versions) for record in records]}
+    return json.dumps(document, separators=(",", ":")).encode("utf-8")
+
+
+def get_body(source_id=None, platforms=()):
+    # Precomputed per generation: thousands of polls between refreshes cost a dict lookup each
+    global _bodies_generation
+    versions = snapshot.get_snapshot()
+    # Only real platforms make it into the key, so arbitrary query strings can't grow the cache
+    filtered = bool(platforms)
+    platforms = tuple(platform for platform in platforms if platform in versions.by_platform)
+    key = (source_id, platforms, filtered)
+    with _bodies_lock:
+        if _bodies_generation != versions.generation:
+            _bodies.clear()
+            _bodies_generation = versions.generation
+        cached = _bodies.get(key)
+    if cached is not None:
+        return cached
+
+    body = build_body(versions, source_id, platforms, filtered)
+    if body is None:
+        return None
+    etag = f'"{versions.generation}-{hashlib.sha1(body).hexdigest()[:16]}"'
+    cached = (etag, body, gzip.compress(body))
+    with _bodies_lock:
+        if _bodies_generation == versions.generation:
+            _bodies[key] = cached
+    return cached
+
+
+class VersionsHandler(BaseHTTPRequestHandler):
+    server_version = "1password-versions"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        if parts == ["events"]:
+            self.stream_events(parse_qs(url.query))
+            return
+        if parts == ["metrics"]:
+            self.send_metrics()
+            return
+        if parts == ["matrix"]:
+            cached = get_body(MATRIX)
+        elif not parts or parts[0] != "versions" or len(parts) > 2:
+            self.send_error(404)
+            return
+        else:
+            query = parse_qs(url.query)
+            platforms = tuple(sorted({platform for value in query.get("platform", []) for platform in value.split(",")
+                                      if platform}))
+            cached = get_body(parts[1] if len(parts) == 2 else None, platforms)
+        if cached is None:
+            self.send_error(404)
+            return
+        etag, body, gzipped = cached
+
+        if etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "public, max-age=15")
+            self.end_headers()
+            return
+
+        use_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+        payload = gzipped if use_gzip else body
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "public, max-age=15")
+        self.send_header("Vary", "Accept-Encoding")
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_metrics(self):
+        body = metrics.render()
+        self.send_response(200)
+        self.send_header("Content-Type", metrics.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream_events(self, query):
+        # Server-Sent Events: one `version` event per change. Clients resume with Last-Event-ID (or ?since=),
+        # otherwise they only see changes from now on.
+        try:
+            last_id = int(self.headers.get("Last-Event-ID") or query.get("since", [None])[0] or db.latest_event_id())
+        except ValueError:
+            self.send_error(400)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while True:
+                events = notify.wait_for_events(last_id)
+                if events:
+                    for event in events:
+                        self.wfile.write(notify.format_sse(event))
+                        last_id = event["id"]
+                else:
+                    # Comment line to keep proxies from timing out an idle stream
+                    self.wfile.write(b": keepalive\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def log_message(self, format, *args):
+        # Polling clients would drown the console
+        pass
+
+
+def serve(host="0.0.0.0", port=8502):
+    server = ThreadingHTTPServer((host, port), VersionsHandler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Read-only JSON API for the tracked 1Password versions")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--with-worker", action="store_true", help="also run the refresh worker in this process")
+    args = parser.parse_args()
+
+    func.init_db()
+    if args.with_worker:
+        scheduler.start_background_refresh()
+    serve(args.host, args.port)
@@ -0,0 +1,180 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import replay
+
+RPM_NS = "http://linux.duke.edu/metadata/common"
+REPO_NS = "http://linux.duke.edu/metadata/repo"
+
+
+def synthetic_fixtures(directory, packages):
+    # Packages.gz / InRelease and primary.xml.gz / repomd.xml for every tracked repo, each with `packages`
+    # entries, a few dozen of which are 1password releases scattered through the file
+    import repo_index
+
+    every = max(1, packages // 40)
+    sizes = {}
+    for target in repo_index.TARGETS:
+        if target.format == "deb":
+            dist_url = f"{repo_index.DEB_BASEURL}/{target.arch}/dists/{target.channel}"
+            index_path = f"main/binary-{target.arch}/Packages.gz"
+            stanzas = []
+            for i in range(packages):
+                name = target.package if i % every == 0 else f"synthetic-{i}"
+                stanzas.append(f"Package: {name}\nVersion: 8.{i // every}.{i % 7}-{i % 3}\n"
+                               f"Architecture: {target.arch}\nDescription: synthetic package {i}\n")
+            raw = "\n".join(stanzas).encode("utf-8")
+            body = gzip.compress(raw)
+            release = f"Origin: synthetic\nSHA256:\n {hashlib.sha256(body).hexdigest()} {len(body)} {index_path}\n"
+            replay.save_fixture(directory, f"{dist_url}/InRelease", release.encode("utf-8"))
+            replay.save_fixture(directory, f"{dist_url}/{index_path}", body)
+        else:
+            repo_url = f"{repo_index.RPM_BASEURL}/{target.channel}/{target.arch}"
+            entries = []
+            for i in range(packages):
+                name = target.package if i % every == 0 else f"synthetic-{i}"
+                entries.append(f'<package type="rpm"><name>{name}</name><arch>{target.arch}</arch>'
+                               f'<version epoch="0" ver="8.{i // every}.{i % 7}" rel="{i % 3}"/>'
+                               f'<summary>synthetic package {i}</summary><description>{"x" * 200}</description>'
+                               f'</package>')
+            raw = (f'<?xml version="1.0"?>\n<metadata xmlns="{RPM_NS}" packages="{packages}">'
+                   + "".join(entries) + "</metadata>").encode("utf-8")
+            body = gzip.compress(raw)
+            repomd = (f'<?xml version="1.0"?>\n<repomd xmlns="{REPO_NS}"><data type="primary">'
+                      f'<checksum type="sha256">{hashlib.sha256(body).hexdigest()}</checksum>'
+                      f'<location href="repodata/primary.xml.gz"/></data></repomd>')
+            replay.save_fixture(directory, f"{repo_url}/repodata/repomd.xml", repomd.encode("utf-8"))
+            replay.save_fixture(directory, f"{repo_url}/repodata/primary.xml.gz", body)
+        sizes[repo_index.index_key(target)] = (len(body), len(raw))
+    return sizes
+
+
+def peak_rss_kib():
+    # The child's own high-water mark. getrusage()'s ru_maxrss can't be used here: on Linux it carries the
+    # parent's peak across fork and exec.
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    raise LookupError("VmHWM missing from /proc/self/status")
+
+
+def fetch_stats(replay_url):
+    with urllib.request.urlopen(f"{replay_url}/__stats__") as response:
+        return json.load(response)
+
+
+def run_one(scraper_id, replay_url):
+    # Runs in its own process, so peak RSS belongs to this scraper alone. The database isn't touched: the
+    # repo-index fetcher is run cold, as if nothing were cached.
+    import functions as func
+    import metrics
+
+    scraper = func.SCRAPERS[scraper_id]
+    before = fetch_stats(replay_url)
+    rss_before = peak_rss_kib()
+    parsed_before = metrics.PARSED_BYTES.total()
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+
+    try:
+        if scraper.fetcher.cached:
+            results, _ = scraper.fetcher.run(list(scraper.members), scraper.timeout, {})
+        else:
+            results = scraper.fetcher.run(list(scraper.members), scraper.timeout)
+    except Exception as e:
+        # A batched fetcher fails all of its sources at once
+        results = {source_id: e for source_id in scraper.rows}
+
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    rss_after = peak_rss_kib()
+    parsed = metrics.PARSED_BYTES.total() - parsed_before
+    after = fetch_stats(replay_url)
+
+    # Regional sources report every storefront separately
+    results = {(f"{source_id}@{region}" if isinstance(result, dict) else source_id): value
+               for source_id, result in results.items()
+               for region, value in (result.items() if isinstance(result, dict) else [(None, result)])}
+    failures = {source_id: f"{type(result).__name__}: {result}"
+                for source_id, result in results.items() if isinstance(result, Exception)}
+    return {
+        "scraper": scraper_id,
+        "wall_s": round(wall, 4),
+        "cpu_s": round(cpu, 4),
+        "peak_rss_kib": rss_after,
+        "rss_growth_kib": rss_after - rss_before,
+        # Served is what came over the wire, compressed; parsed is what the parsers read, decompressed
+        "bytes": sum(after.values()) - sum(before.values()),
+        "parsed_bytes": parsed,
+        "ok": len(results) - len(failures),
+        "failed": failures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every scraper offline against recorded fixtures")
+    parser.add_argument("--fixtures", default="fixtures", help="recorded fixtures (see VERSIONS_RECORD_DIR)")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="replace the deb/rpm indexes with synthetic ones of this many packages")
+    parser.add_argument("--scraper", action="append", help="only benchmark these scrapers")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print raw JSON lines instead of a table")
+    parser.add_argument("--one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one:
+        print(json.dumps(run_one(args.one, os.environ["VERSIONS_REPLAY_URL"])))
+        return
+
+    directories = []
+    synthetic_dir = None
+    if args.synthetic:
+        synthetic_dir = tempfile.mkdtemp(prefix="versions-bench-")
+        for key, (compressed, raw) in synthetic_fixtures(synthetic_dir, args.synthetic).items():
+            print(f"synthetic {key}: {args.synthetic} packages, {compressed} bytes gzipped, {raw} bytes raw")
+        directories.append(synthetic_dir)
+    directories.append(args.fixtures)
+
+    server = replay.start_server(directories)
+    env = {**os.environ, "VERSIONS_REPLAY_URL": server.base_url}
+    env.pop("VERSIONS_RECORD_DIR", None)
+    try:
+        if args.scraper:
+            scraper_ids = args.scraper
+        else:
+            import functions as func
+            scraper_ids = list(func.SCRAPERS)
+
+        if not args.json:
+            print(f"{'scraper':<32}{'wall s':>10}{'cpu s':>10}{'peak RSS MiB':>14}{'served':>12}{'parsed':>12}  result")
+        for scraper_id in scraper_ids:
+            for _ in range(args.repeat):
+                output = subprocess.run([sys.executable, __file__, "--one", scraper_id], env=env,
+                                        capture_output=True, text=True, check=True).stdout
+                report = json.loads(output.strip().splitlines()[-1])
+                if args.json:
+                    print(json.dumps(report))
+                    continue
+                result = f"{report['ok']} ok" + (f", {len(report['failed'])} failed: {report['failed']}"
+                                                  if report['failed'] else "")
+                print(f"{scraper_id:<32}{report['wall_s']:>10.3f}{report['cpu_s']:>10.3f}"
+                      f"{report['peak_rss_kib'] / 1024:>14.1f}{report['bytes']:>12}{report['parsed_bytes']:>12}"
+                      f"  {result}")
+    finally:
+        server.shutdown()
+        if synthetic_dir:
+            shutil.rmtree(synthetic_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import atexit
+import importlib.metadata
+import os
+import queue
+import subprocess
+import sys
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+# Nothing we scrape needs these to work out a version number, so don't download them
+BLOCKED_RESOURCE_TYPES = frozenset({"image", "media", "font", "texttrack", "manifest"})
+
+USER_AGENT = (
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/120.0.0.0 Safari/537.36"
+)
+
+_install_lock = threading.Lock()
+_installed = False
+
+# Browsers kept running, so a few Play Store storefronts can render at once
+POOL_SIZE = 2
+
+_pool_lock = threading.Lock()
+_pool = None
+
+
+def install_marker():
+    # One marker per Playwright release, since each one wants its own Chromium build
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache, "1password-versions",
+                        f"playwright-{importlib.metadata.version('playwright')}-chromium.installed")
+
+
+def ensure_installed(executable_path=None):
+    # Download the Chromium build Playwright needs. After the first successful install a marker is left behind,
+    # so later processes skip the installer entirely unless the browser itself has gone missing.
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        marker = install_marker()
+        if not os.path.exists(marker) or (executable_path and not os.path.exists(executable_path)):
+            subprocess.run([sys.executable, "-m", "playwright", "install", "chromium"], check=True)
+            os.makedirs(os.path.dirname(marker), exist_ok=True)
+            with open(marker, "w") as f:
+                f.write(f"{executable_path or ''}\n")
+        _installed = True
+
+
+def _block_unneeded(route):
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        route.abort()
+    else:
+        route.continue_()
+
+
+class BrowserPool:
+    # Playwright's sync API is tied to the thread that started it, so each browser lives on its own worker
+    # thread and jobs are handed to it through a queue. The browser is launched once and reused; every job
+    # gets a fresh, isolated context that is thrown away afterwards.
+
+    def __init__(self, size=1):
+        self._jobs = queue.Queue()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"browser-{i}", daemon=True) for i in range(size)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, job) -> Future:
+        # job is called with a new BrowserContext and its return value becomes the future's result
+        future = Future()
+        self._jobs.put((job, future))
+        return future
+
+    def run(self, job, timeout=None):
+        future = self.submit(job)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            # Nobody is waiting for it any more: if it hasn't started, don't let it hold up the jobs behind it
+            future.cancel()
+            raise
+
+    def close(self):
+        for _ in self._threads:
+            self._jobs.put(None)
+
+    def _worker(self):
+        # Imported here so processes that never render a page don't pay for Playwright
+        from playwright.sync_api import sync_playwright
+
+        with sync_playwright() as p:
+            browser = None
+            while True:
+                item = self._jobs.get()
+                if item is None:
+                    break
+                job, future = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    # Relaunch if this is the first job or the browser has crashed since the last one
+                    if browser is None or not browser.is_connected():
+                        ensure_installed(p.chromium.executable_path)
+                        browser = p.chromium.launch(headless=True)
+                    context = browser.new_context(user_agent=USER_AGENT)
+                    try:
+                        context.route("**/*", _block_unneeded)
+                        result = job(context)
+                    finally:
+                        context.close()
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            if browser is not None:
+                browser.close()
+
+
+def get_pool() -> BrowserPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool(POOL_SIZE)
+            atexit.register(_pool.close)
+        return _pool
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Install the browser the Play Store scraper needs, if it isn't already")
+    parser.parse_args()
+    from playwright.sync_api import sync_playwright
+
+    with sync_playwright() as p:
+        ensure_installed(p.chromium.executable_path)
+    print(f"Chromium ready ({install_marker()})")
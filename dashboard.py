@@ -0,0 +1,96 @@
+from typing import NamedTuple
+
+import streamlit as st
+
+import functions as func
+import snapshot
+import sources
+
+# The dashboard's sections, in order: (platform, heading)
+SECTIONS = (
+    ('browser_extension', "Browser Extensions"),
+    ('mobile', "Mobile Apps"),
+    ('desktop', "Desktop Apps"),
+)
+CARD_WIDTH = 250
+# Card titles, straight from the source registry
+NAMES = {source.id: source.name for source in sources.SOURCES}
+# How often a session looks for new data (seconds). The page is only redrawn when there is some.
+CHANGE_CHECK_INTERVAL = 30
+
+
+class Card(NamedTuple):
+    # Everything one card shows, already formatted
+    title: str
+    channel: str
+    version: str
+    # Captions under the version: how it compares, whether it's stale, how far it has rolled out
+    notes: tuple
+    # The last successful and failed check lines
+    checks: tuple
+
+
+class ViewModel(NamedTuple):
+    generation: int
+    # (heading, card ids) per non-empty section; a change here needs the whole page redrawn
+    layout: tuple
+    cards: dict
+
+
+def build_card(versions, row) -> Card:
+    indicator = "🟢" if row.healthy else "🔴"
+    notes = (func.format_standing(versions.standings.get(row.id)),
+             func.format_staleness(row, versions.paused.get(row.id)),
+             func.format_rollout(versions.source_regions(row.id), row.version))
+    checks = []
+    if row.success_check > 0:
+        checks.append(f"{indicator} *Last successful check: **{func.format_datetime(row.success_check)}***")
+    if row.fail_check > row.success_check:
+        checks.append(f"{indicator} *Last failed check: **{func.format_datetime(row.fail_check)}** "
+                      f"with error message: **{row.error_message}***")
+    return Card(NAMES.get(row.id) or row.browser, row.channel, row.version,
+                tuple(note for note in notes if note), tuple(checks))
+
+
+# Built once per generation and shared by every session, like the snapshot it comes from
+@st.cache_resource(max_entries=2)
+def build_view_model(generation) -> ViewModel:
+    versions = snapshot.load_snapshot(generation)
+    layout = tuple((heading, tuple(row.id for row in versions.platform(platform)))
+                   for platform, heading in SECTIONS if versions.platform(platform))
+    cards = {row.id: build_card(versions, row) for row in versions.records}
+    return ViewModel(generation, layout, cards)
+
+
+def current_view_model() -> ViewModel:
+    return build_view_model(snapshot.get_snapshot().generation)
+
+
+@st.fragment(run_every=CHANGE_CHECK_INTERVAL)
+def watch_for_changes(generation):
+    # The page's only timer, and all it does is compare one number: the generation check is shared by every
+    # session and only touches the database every few seconds. The cards are redrawn only once a refresh has
+    # written something new.
+    if snapshot.get_snapshot().generation != generation:
+        st.rerun()
+
+
+def render_card(card):
+    st.subheader(card.title)
+    st.caption(f"*{card.channel}*")
+    st.write(f"**Version: `{card.version}`**")
+    for note in card.notes:
+        st.caption(note)
+    for check in card.checks:
+        st.write(check)
+
+
+def render():
+    model = current_view_model()
+    for heading, card_ids in model.layout:
+        with st.container(width=CARD_WIDTH * len(card_ids)):
+            st.header(heading)
+            for card_id, col in zip(card_ids, st.columns(len(card_ids), border=True)):
+                with col:
+                    render_card(model.cards[card_id])
+    watch_for_changes(model.generation)
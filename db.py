@@ -0,0 +1,285 @@
+import json
+from datetime import datetime
+
+import streamlit as st
+from sqlalchemy import text
+
+import metrics
+
+
+# Each migration moves the schema up one version; PRAGMA user_version records how far a database has got
+MIGRATIONS = (
+    # 1: the original schema, where every versions column is TEXT
+    (
+        'CREATE TABLE IF NOT EXISTS versions (id TEXT, platform TEXT, browser TEXT, channel TEXT, version TEXT, '
+        'success_check TEXT, fail_check TEXT, error_message TEXT);',
+        'CREATE TABLE IF NOT EXISTS source_cache (key TEXT PRIMARY KEY, value TEXT);',
+    ),
+    # 2: a primary key on id, numeric timestamps and an index for the per-platform reads
+    (
+        'DROP TABLE IF EXISTS versions_new;',
+        """CREATE TABLE versions_new (
+               id TEXT PRIMARY KEY,
+               platform TEXT NOT NULL,
+               browser TEXT NOT NULL,
+               channel TEXT NOT NULL,
+               version TEXT NOT NULL DEFAULT '',
+               success_check REAL NOT NULL DEFAULT 0,
+               fail_check REAL NOT NULL DEFAULT 0,
+               error_message TEXT NOT NULL DEFAULT ''
+           );""",
+        """INSERT OR IGNORE INTO versions_new
+               (id, platform, browser, channel, version, success_check, fail_check, error_message)
+           SELECT id, platform, browser, channel, COALESCE(version, ''),
+                  CAST(COALESCE(NULLIF(success_check, ''), 0) AS REAL),
+                  CAST(COALESCE(NULLIF(fail_check, ''), 0) AS REAL),
+                  COALESCE(error_message, '')
+           FROM versions WHERE id IS NOT NULL ORDER BY rowid;""",
+        'DROP TABLE versions;',
+        'ALTER TABLE versions_new RENAME TO versions;',
+        'CREATE INDEX IF NOT EXISTS versions_platform ON versions (platform);',
+    ),
+    # 3: an append-only timeline of version changes, plus the raw check heartbeats and their daily roll-ups.
+    # check_log is partitioned by `day` (days since the epoch) so retention is a cheap range delete.
+    (
+        """CREATE TABLE IF NOT EXISTS version_history (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               source_id TEXT NOT NULL,
+               version TEXT NOT NULL,
+               previous_version TEXT,
+               seen_at REAL NOT NULL
+           );""",
+        'CREATE INDEX IF NOT EXISTS version_history_source ON version_history (source_id, seen_at);',
+        'CREATE INDEX IF NOT EXISTS version_history_version ON version_history (source_id, version);',
+        'CREATE INDEX IF NOT EXISTS version_history_seen ON version_history (seen_at);',
+        """CREATE TABLE IF NOT EXISTS check_log (
+               source_id TEXT NOT NULL,
+               day INTEGER NOT NULL,
+               checked_at REAL NOT NULL,
+               ok INTEGER NOT NULL,
+               error_message TEXT
+           );""",
+        'CREATE INDEX IF NOT EXISTS check_log_day ON check_log (day, source_id);',
+        """CREATE TABLE IF NOT EXISTS check_daily (
+               source_id TEXT NOT NULL,
+               day INTEGER NOT NULL,
+               checks INTEGER NOT NULL,
+               failures INTEGER NOT NULL,
+               first_check REAL NOT NULL,
+               last_check REAL NOT NULL,
+               PRIMARY KEY (source_id, day)
+           );""",
+        # Start the timeline from whatever we already know
+        """INSERT INTO version_history (source_id, version, previous_version, seen_at)
+           SELECT id, version, NULL, success_check FROM versions WHERE version != '' ORDER BY rowid;""",
+    ),
+    # 4: a generation counter that every write to versions bumps, so readers can tell when to reload
+    (
+        'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);',
+        "INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 1);",
+    ),
+    # 5: how far each webhook subscriber has got through version_history, which doubles as the event log
+    (
+        """CREATE TABLE IF NOT EXISTS webhook_cursor (
+               url TEXT PRIMARY KEY,
+               last_id INTEGER NOT NULL,
+               attempts INTEGER NOT NULL DEFAULT 0,
+               next_attempt REAL NOT NULL DEFAULT 0,
+               last_error TEXT
+           );""",
+    ),
+    # 6: the latest version each storefront reports for sources checked in several regions
+    (
+        """CREATE TABLE IF NOT EXISTS region_versions (
+               source_id TEXT NOT NULL,
+               region TEXT NOT NULL,
+               version TEXT NOT NULL DEFAULT '',
+               success_check REAL NOT NULL DEFAULT 0,
+               fail_check REAL NOT NULL DEFAULT 0,
+               error_message TEXT NOT NULL DEFAULT '',
+               PRIMARY KEY (source_id, region)
+           );""",
+    ),
+    # 7: the refresh schedule (and with it each scraper's circuit breaker), so readers can rely on it existing
+    (
+        'CREATE TABLE IF NOT EXISTS source_schedule (id TEXT PRIMARY KEY, next_due REAL, failures INTEGER);',
+    ),
+    # 8: the lease that lets only one worker refresh at a time, which used to be created by the worker itself
+    (
+        'CREATE TABLE IF NOT EXISTS refresh_lease (name TEXT PRIMARY KEY, owner TEXT, expires REAL);',
+        "INSERT OR IGNORE INTO refresh_lease (name, owner, expires) VALUES ('refresh', '', 0);",
+    ),
+)
+
+# Raw check heartbeats are kept this long before being rolled up into one row per source per day
+CHECK_LOG_DAYS = 14
+# Daily roll-ups are kept this long; version_history itself is never pruned
+CHECK_DAILY_DAYS = 3 * 365
+
+
+@metrics.timed_db('migrate')
+def migrate():
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        current = s.execute(text('PRAGMA user_version;')).scalar() or 0
+        for version, statements in enumerate(MIGRATIONS, start=1):
+            if version <= current:
+                continue
+            for statement in statements:
+                s.execute(text(statement))
+            # PRAGMA doesn't take bound parameters
+            s.execute(text(f'PRAGMA user_version = {version:d};'))
+            s.commit()
+
+
+# Small persistent key/value store for scrapers to remember index checksums and the answers they led to
+@metrics.timed_db('load_cache')
+def load_cache():
+    # The whole source cache in one query: a handful of small entries, one per repository index
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        rows = s.execute(text('SELECT key, value FROM source_cache;')).all()
+    return {key: json.loads(value) for key, value in rows if value}
+
+
+def error_message(error):
+    return f"Scrape failed: {type(error).__name__}: {error}"
+
+
+@metrics.timed_db('write_results')
+def write_results(results, regions=None, cache=None):
+    # results maps source id -> the version found, or the exception that stopped us finding it, and regions maps
+    # source id -> {region: the same} for sources checked in several storefronts. cache holds the source cache
+    # entries the refresh changed. Everything is written in one transaction, so readers see either all of a
+    # refresh or none of it.
+    checked_at = datetime.now().timestamp()
+    successes = [{"id": source_id, "version": str(result), "success_check": checked_at}
+                 for source_id, result in results.items() if not isinstance(result, Exception)]
+    failures = [{"id": source_id, "error_message": error_message(result), "fail_check": checked_at}
+                for source_id, result in results.items() if isinstance(result, Exception)]
+    if not successes and not failures:
+        return
+
+    region_rows = [{"id": source_id, "region": region, "result": result}
+                   for source_id, by_region in (regions or {}).items() for region, result in by_region.items()]
+    region_successes = [{"id": row["id"], "region": row["region"], "version": str(row["result"]),
+                         "success_check": checked_at}
+                        for row in region_rows if not isinstance(row["result"], Exception)]
+    region_failures = [{"id": row["id"], "region": row["region"], "error_message": error_message(row["result"]),
+                        "fail_check": checked_at}
+                       for row in region_rows if isinstance(row["result"], Exception)]
+
+    heartbeats = ([{"id": row["id"], "checked_at": checked_at, "ok": 1, "error_message": None} for row in successes]
+                  + [{"id": row["id"], "checked_at": checked_at, "ok": 0, "error_message": row["error_message"]}
+                     for row in failures])
+
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        if successes:
+            # Only real transitions go into the timeline, so it has to happen before the row is overwritten
+            s.execute(text(
+                "INSERT INTO version_history (source_id, version, previous_version, seen_at) "
+                "SELECT id, :version, NULLIF(version, ''), :success_check FROM versions "
+                "WHERE id = :id AND version != :version;"),
+                successes, )
+            s.execute(text(
+                "UPDATE versions SET version = :version, success_check = :success_check WHERE id = :id;"),
+                successes, )
+        if failures:
+            s.execute(text(
+                "UPDATE versions SET fail_check = :fail_check, error_message = :error_message WHERE id = :id;"),
+                failures, )
+        if region_successes:
+            s.execute(text(
+                "INSERT INTO region_versions (source_id, region, version, success_check) "
+                "VALUES (:id, :region, :version, :success_check) "
+                "ON CONFLICT (source_id, region) DO UPDATE SET "
+                "version = excluded.version, success_check = excluded.success_check;"),
+                region_successes, )
+        if region_failures:
+            s.execute(text(
+                "INSERT INTO region_versions (source_id, region, fail_check, error_message) "
+                "VALUES (:id, :region, :fail_check, :error_message) "
+                "ON CONFLICT (source_id, region) DO UPDATE SET "
+                "fail_check = excluded.fail_check, error_message = excluded.error_message;"),
+                region_failures, )
+        s.execute(text(
+            "INSERT INTO check_log (source_id, day, checked_at, ok, error_message) "
+            "VALUES (:id, CAST(:checked_at / 86400 AS INTEGER), :checked_at, :ok, :error_message);"),
+            heartbeats, )
+        if cache:
+            s.execute(text('INSERT OR REPLACE INTO source_cache (key, value) VALUES (:key, :value);'),
+                      [{"key": key, "value": json.dumps(value)} for key, value in cache.items()], )
+        bump_generation(s)
+        s.commit()
+
+
+def bump_generation(s):
+    s.execute(text("UPDATE meta SET value = value + 1 WHERE key = 'generation';"))
+
+
+@metrics.timed_db('compact_history')
+def compact_history(now=None, check_log_days=CHECK_LOG_DAYS, check_daily_days=CHECK_DAILY_DAYS):
+    # Roll whole days of raw heartbeats up into check_daily, then drop the expired days from both tables
+    now = datetime.now().timestamp() if now is None else now
+    today = int(now // 86400)
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        s.execute(text(
+            """INSERT INTO check_daily (source_id, day, checks, failures, first_check, last_check)
+               SELECT source_id, day, COUNT(*), SUM(1 - ok), MIN(checked_at), MAX(checked_at)
+               FROM check_log WHERE day < :cutoff GROUP BY source_id, day
+               ON CONFLICT (source_id, day) DO UPDATE SET
+                   checks = checks + excluded.checks,
+                   failures = failures + excluded.failures,
+                   first_check = MIN(first_check, excluded.first_check),
+                   last_check = MAX(last_check, excluded.last_check);"""),
+            {"cutoff": today - check_log_days}, )
+        s.execute(text('DELETE FROM check_log WHERE day < :cutoff;'), {"cutoff": today - check_log_days})
+        s.execute(text('DELETE FROM check_daily WHERE day < :cutoff;'), {"cutoff": today - check_daily_days})
+        s.commit()
+
+
+@metrics.timed_db('version_first_seen')
+def version_first_seen(source_id, version):
+    # When did this source move to this version? (None if we've never seen it)
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        return s.execute(text(
+            'SELECT MIN(seen_at) FROM version_history WHERE source_id = :source_id AND version = :version;'),
+            {"source_id": source_id, "version": version}).scalar()
+
+
+@metrics.timed_db('releases_since')
+def releases_since(since, source_id=None):
+    # Every version change since `since` (epoch seconds), newest first, optionally for just one source
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        if source_id is None:
+            rows = s.execute(text(
+                'SELECT source_id, version, previous_version, seen_at FROM version_history '
+                'WHERE seen_at >= :since ORDER BY seen_at DESC;'), {"since": since}).all()
+        else:
+            rows = s.execute(text(
+                'SELECT source_id, version, previous_version, seen_at FROM version_history '
+                'WHERE source_id = :source_id AND seen_at >= :since ORDER BY seen_at DESC;'),
+                {"source_id": source_id, "since": since}).all()
+    return [row._asdict() for row in rows]
+
+
+@metrics.timed_db('latest_event_id')
+def latest_event_id():
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        return s.execute(text('SELECT MAX(id) FROM version_history;')).scalar() or 0
+
+
+@metrics.timed_db('events_since')
+def events_since(last_id, limit=100):
+    # Version changes after `last_id`, oldest first
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        rows = s.execute(text(
+            'SELECT id, source_id, version, previous_version, seen_at FROM version_history '
+            'WHERE id > :last_id ORDER BY id LIMIT :limit;'), {"last_id": last_id, "limit": limit}).all()
+    return [row._asdict() for row in rows]
@@ -0,0 +1,187 @@
+import io
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+import replay
+
+# (connect, read) timeouts in seconds, so a stalled host can never hang a scrape
+DEFAULT_TIMEOUT = (5, 20)
+# Responses bigger than this aren't kept in memory for conditional requests
+MAX_CACHED_BODY = 1024 * 1024
+
+# Per upstream host: (requests in flight at once, request starts per second). Regional sources hit the same
+# store API once per storefront, so these keep a refresh from looking like a burst. Rendered Play Store pages
+# don't come through here; browser_pool.POOL_SIZE limits those.
+HOST_LIMITS = {
+    "itunes.apple.com": (4, 5.0),
+    "microsoftedge.microsoft.com": (4, 5.0),
+}
+DEFAULT_HOST_LIMIT = (8, 20.0)
+
+USER_AGENT = "1password-current-versions (+https://github.com/SpinyN0rman/1password-current-public-app)"
+
+# Set VERSIONS_REPLAY_URL to send every request to a replay.py stand-in instead of the internet, and
+# VERSIONS_RECORD_DIR to save every good response as a fixture for it
+REPLAY_URL = os.environ.get("VERSIONS_REPLAY_URL")
+RECORD_DIR = os.environ.get("VERSIONS_RECORD_DIR")
+
+_session = None
+_session_lock = threading.Lock()
+
+# url -> last 200 response, used to revalidate with ETag / Last-Modified
+_cache = {}
+_cache_lock = threading.Lock()
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class _HostLimiter:
+
+    def __init__(self, concurrency, per_second):
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._spacing = 1.0 / per_second
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    @contextmanager
+    def slot(self):
+        with self._slots:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start)
+                self._next_start = start + self._spacing
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+
+def host_limit(host):
+    # Hold the returned context manager for the duration of a request to `host`
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = _limiters[host] = _HostLimiter(*HOST_LIMITS.get(host, DEFAULT_HOST_LIMIT))
+    return limiter.slot()
+
+
+def get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=3,
+                connect=3,
+                read=2,
+                status=2,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset({"GET", "HEAD"}),
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            # One pooled, keep-alive connection set per host; sized for every scraper running at once
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retry)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["User-Agent"] = USER_AGENT
+            _session = session
+        return _session
+
+
+def get(url, timeout=DEFAULT_TIMEOUT, stream=False, conditional=True, headers=None, check=True,
+        **kwargs) -> requests.Response:
+    # A GET through the shared session. With conditional=True the last good response is revalidated with
+    # If-None-Match / If-Modified-Since, and a 304 hands back that cached response (not_modified=True).
+    # Streamed responses are never cached, but still revalidate if the caller supplies the validators.
+    # Error statuses (once retries are spent) raise HTTPError unless check=False, so an error page is never
+    # parsed as data.
+    headers = dict(headers or {})
+    cached = None
+    if conditional and not stream:
+        with _cache_lock:
+            cached = _cache.get(url)
+        if cached is not None:
+            if cached.headers.get("ETag"):
+                headers["If-None-Match"] = cached.headers["ETag"]
+            if cached.headers.get("Last-Modified"):
+                headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+
+    host = urlsplit(url).netloc
+    source = metrics.current_source()
+    try:
+        with host_limit(host):
+            started = time.perf_counter()
+            try:
+                response = get_session().get(route(url), timeout=timeout, stream=stream, headers=headers, **kwargs)
+            finally:
+                metrics.HTTP_SECONDS.observe(time.perf_counter() - started, source=source, host=host)
+    except Exception:
+        metrics.HTTP_REQUESTS.inc(source=source, host=host, code="error")
+        raise
+    metrics.HTTP_REQUESTS.inc(source=source, host=host, code=response.status_code)
+    retries = getattr(response.raw, "retries", None)
+    if retries is not None and retries.history:
+        metrics.HTTP_RETRIES.inc(len(retries.history), source=source, host=host)
+    if not stream:
+        count_downloaded(url, len(response.content))
+
+    if RECORD_DIR and response.status_code == 200:
+        record(url, response.content, response.headers)
+        if stream:
+            # The body has been read to save it, so hand streaming callers a fresh file over it
+            response.raw = io.BytesIO(response.content)
+
+    if response.status_code == 304:
+        response.close()
+        if cached is not None:
+            cached.not_modified = True
+            return cached
+    response.not_modified = response.status_code == 304
+    if check and response.status_code >= 400:
+        response.close()
+        response.raise_for_status()
+
+    if (conditional and not stream and response.status_code == 200
+            and (response.headers.get("ETag") or response.headers.get("Last-Modified"))
+            and len(response.content) <= MAX_CACHED_BODY):
+        with _cache_lock:
+            _cache[url] = response
+    return response
+
+
+def count_downloaded(url, size):
+    # Streamed bodies are counted by whoever reads them, once they have
+    metrics.HTTP_BYTES.inc(size, source=metrics.current_source(), host=urlsplit(url).netloc)
+
+
+def route(url):
+    if REPLAY_URL:
+        return REPLAY_URL.rstrip("/") + replay.replay_path(url)
+    return url
+
+
+def record(url, body, headers=None):
+    if RECORD_DIR:
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        replay.save_fixture(RECORD_DIR, url, body, headers)
+
+
+def post_json(url, payload, timeout=DEFAULT_TIMEOUT, headers=None) -> requests.Response:
+    # POSTs aren't retried by the session; callers that need delivery guarantees retry themselves
+    return get_session().post(url, json=payload, timeout=timeout, headers=headers)
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,237 @@
+import contextvars
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; scrapes run from milliseconds (a JSON API) up to a couple of minutes (a rendered Play Store page)
+FAST_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 90, 120, 180)
+
+# The source (or repo index) whose work the current thread is doing, so HTTP and parse metrics can be told apart
+_current_source = contextvars.ContextVar("metrics_source", default="")
+
+_registry_lock = threading.Lock()
+_registry = []
+_collectors = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self):
+        with self._lock:
+            return sum(self._values.values())
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=FAST_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, (("le", _format_value(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def current_source():
+    return _current_source.get()
+
+
+@contextmanager
+def source_scope(source_id):
+    # Everything measured inside is labelled with `source_id`. Threads started inside need
+    # contextvars.copy_context() to inherit it.
+    token = _current_source.set(source_id)
+    try:
+        yield
+    finally:
+        _current_source.reset(token)
+
+
+def timed_db(operation):
+    # Decorator timing a database call into DB_SECONDS, and counting the ones that raise
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                DB_ERRORS.inc(operation=operation)
+                raise
+            finally:
+                DB_SECONDS.observe(time.perf_counter() - started, operation=operation)
+        return wrapper
+    return decorator
+
+
+def register_collector(collect):
+    # `collect` is called on every scrape of /metrics to refresh gauges that are read rather than counted
+    with _registry_lock:
+        if collect not in _collectors:
+            _collectors.append(collect)
+
+
+def render() -> bytes:
+    with _registry_lock:
+        collectors = list(_collectors)
+        metrics = list(_registry)
+    for collect in collectors:
+        try:
+            collect()
+        except Exception:
+            COLLECT_ERRORS.inc()
+            logger.exception("Metrics collection failed")
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.header())
+        lines.extend(metric.render())
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+SCRAPE_SECONDS = Histogram("versions_scrape_duration_seconds", "Wall time of one scraper run.",
+                           ("scraper",), SLOW_BUCKETS)
+SCRAPE_RESULTS = Counter("versions_scrape_results_total", "Sources checked, by outcome (success, failure, timeout).",
+                         ("source", "result"))
+HTTP_SECONDS = Histogram("versions_http_request_duration_seconds",
+                         "Upstream request time, retries included. Streamed bodies are read afterwards and not counted.",
+                         ("source", "host"))
+HTTP_REQUESTS = Counter("versions_http_requests_total", "Upstream requests, by status code (or 'error').",
+                        ("source", "host", "code"))
+HTTP_RETRIES = Counter("versions_http_retries_total", "Upstream requests retried by the session.",
+                       ("source", "host"))
+HTTP_BYTES = Counter("versions_http_downloaded_bytes_total", "Response body bytes read from upstream.",
+                     ("source", "host"))
+PARSE_SECONDS = Histogram("versions_parse_duration_seconds",
+                          "Time spent pulling versions out of a response. Streamed repo indexes include the read.",
+                          ("source",), FAST_BUCKETS + (30, 60))
+PARSED_BYTES = Counter("versions_parsed_bytes_total", "Bytes handed to a parser, after decompression.",
+                       ("source",))
+DB_SECONDS = Histogram("versions_db_duration_seconds", "Time spent in a database call.", ("operation",))
+DB_ERRORS = Counter("versions_db_errors_total", "Database calls that raised.", ("operation",))
+LAST_SUCCESS = Gauge("versions_last_success_timestamp_seconds", "When each source last returned a version.",
+                     ("source",))
+LAST_FAILURE = Gauge("versions_last_failure_timestamp_seconds", "When each source last failed.", ("source",))
+HEALTHY = Gauge("versions_source_healthy", "1 if a source's latest check succeeded.", ("source",))
+BREAKER_OPEN = Gauge("versions_breaker_open", "1 while a source's circuit breaker is open and it isn't being scraped.",
+                     ("source",))
+COLLECT_ERRORS = Counter("versions_metrics_collect_errors_total", "Failures reading gauges for /metrics.")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(host="0.0.0.0", port=9101) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
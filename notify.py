@@ -0,0 +1,203 @@
+import argparse
+import json
+import logging
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import streamlit as st
+from sqlalchemy import text
+
+import db
+import http_client
+import metrics
+
+# How often waiting SSE clients and the webhook dispatcher look for changes written by another process (seconds)
+POLL_INTERVAL = 5.0
+# Failed webhook deliveries are retried after RETRY_BASE seconds, doubling up to MAX_BACKOFF, MAX_ATTEMPTS times
+RETRY_BASE = 10
+MAX_BACKOFF = 3600
+MAX_ATTEMPTS = 10
+# How long a dispatcher holds a subscriber while it delivers one event, so another process's dispatcher leaves it
+# alone (seconds). Comfortably longer than a delivery's timeout.
+CLAIM_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+_condition = threading.Condition()
+_latest_lock = threading.Lock()
+_latest_id = 0
+_latest_checked_at = 0.0
+
+_dispatcher_lock = threading.Lock()
+_dispatcher_thread = None
+_stop_event = threading.Event()
+
+
+def webhook_urls():
+    # Subscribers come from `webhook_urls` in secrets.toml, or a comma separated VERSIONS_WEBHOOK_URLS
+    urls = os.environ.get('VERSIONS_WEBHOOK_URLS')
+    if urls is not None:
+        return [url.strip() for url in urls.split(',') if url.strip()]
+    try:
+        return list(st.secrets.get('webhook_urls', []))
+    except Exception:
+        return []
+
+
+def publish():
+    # Called by the refresh worker once a refresh is written: wake every SSE client and the dispatcher now,
+    # rather than at their next poll
+    global _latest_checked_at
+    with _latest_lock:
+        _latest_checked_at = 0.0
+    with _condition:
+        _condition.notify_all()
+
+
+def latest_id():
+    # Shared by every SSE client, so thousands of open streams cost one tiny query a second
+    global _latest_id, _latest_checked_at
+    with _latest_lock:
+        now = time.monotonic()
+        if now - _latest_checked_at >= 1.0:
+            _latest_id = db.latest_event_id()
+            _latest_checked_at = now
+        return _latest_id
+
+
+def wait_for_events(last_id, timeout=15.0):
+    # Block until there are version changes after `last_id` (or the timeout passes) and return them
+    deadline = time.monotonic() + timeout
+    while True:
+        if latest_id() > last_id:
+            return db.events_since(last_id)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return []
+        with _condition:
+            _condition.wait(min(remaining, POLL_INTERVAL))
+
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: version\ndata: {json.dumps(event, separators=(',', ':'))}\n\n".encode("utf-8")
+
+
+def _backoff(attempts):
+    delay = min(RETRY_BASE * 2 ** (attempts - 1), MAX_BACKOFF)
+    return random.uniform(delay / 2, delay)
+
+
+def deliver(url, event, timeout=10.0):
+    # Delivery is at-least-once; receivers can de-duplicate on the event id header
+    response = http_client.post_json(url, event, timeout=timeout, headers={"X-Versions-Event-Id": str(event["id"])})
+    response.raise_for_status()
+
+
+def dispatch_once(urls=None):
+    # Deliver outstanding events to every subscriber, in order. version_history is the outbox: each subscriber
+    # only needs a cursor, and a failing one backs off without holding up the others.
+    urls = webhook_urls() if urls is None else urls
+    if not urls:
+        return
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        # New subscribers start from now rather than replaying the whole history
+        s.execute(text(
+            "INSERT OR IGNORE INTO webhook_cursor (url, last_id) VALUES (:url, (SELECT COALESCE(MAX(id), 0) FROM version_history));"),
+            [{"url": url} for url in urls], )
+        s.commit()
+        cursors = s.execute(text('SELECT url, last_id, attempts, next_attempt FROM webhook_cursor;')).all()
+
+    now = time.time()
+    for url, last_id, attempts, next_attempt in cursors:
+        if url not in urls or next_attempt > now:
+            continue
+        for event in db.events_since(last_id):
+            # Every process runs a dispatcher; only the one that claims the subscriber's cursor delivers
+            if not _claim_cursor(url, last_id):
+                break
+            try:
+                deliver(url, event)
+            except Exception as e:
+                attempts += 1
+                if attempts >= MAX_ATTEMPTS:
+                    # Give up on this event so one poison message can't block the subscriber forever
+                    _save_cursor(url, last_id, event["id"], 0, 0, f"{type(e).__name__}: {e}")
+                else:
+                    _save_cursor(url, last_id, last_id, attempts, time.time() + _backoff(attempts),
+                                 f"{type(e).__name__}: {e}")
+                break
+            if not _save_cursor(url, last_id, event["id"], 0, 0, None):
+                break
+            last_id, attempts = event["id"], 0
+
+
+@metrics.timed_db('claim_webhook_cursor')
+def _claim_cursor(url, last_id) -> bool:
+    # Atomic in SQLite: only one dispatcher can move next_attempt forward from a cursor that's due
+    now = time.time()
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        result = s.execute(text(
+            'UPDATE webhook_cursor SET next_attempt = :until '
+            'WHERE url = :url AND last_id = :last_id AND next_attempt <= :now;'),
+            {"url": url, "last_id": last_id, "until": now + CLAIM_SECONDS, "now": now}, )
+        s.commit()
+    return result.rowcount == 1
+
+
+@metrics.timed_db('save_webhook_cursor')
+def _save_cursor(url, expected_id, last_id, attempts, next_attempt, last_error) -> bool:
+    # Only moves the cursor on from where this dispatcher found it, so it can never go backwards
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        result = s.execute(text(
+            'UPDATE webhook_cursor SET last_id = :last_id, attempts = :attempts, next_attempt = :next_attempt, '
+            'last_error = :last_error WHERE url = :url AND last_id = :expected_id;'),
+            {"url": url, "expected_id": expected_id, "last_id": last_id, "attempts": attempts,
+             "next_attempt": next_attempt, "last_error": last_error}, )
+        s.commit()
+    return result.rowcount == 1
+
+
+def run_dispatcher():
+    while not _stop_event.is_set():
+        try:
+            dispatch_once()
+        except Exception:
+            logger.exception("Webhook dispatch failed")
+        with _condition:
+            _condition.wait(POLL_INTERVAL)
+
+
+def start_dispatcher():
+    global _dispatcher_thread
+    with _dispatcher_lock:
+        if _dispatcher_thread is None or not _dispatcher_thread.is_alive():
+            _dispatcher_thread = threading.Thread(target=run_dispatcher, name='webhook-dispatcher', daemon=True)
+            _dispatcher_thread.start()
+
+
+def stop_dispatcher():
+    _stop_event.set()
+    publish()
+
+
+class StubReceiver(BaseHTTPRequestHandler):
+    # Prints every webhook it receives; point VERSIONS_WEBHOOK_URLS at it to try notifications out locally
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        print(body.decode("utf-8", errors="replace"), flush=True)
+        self.send_response(204)
+        self.end_headers()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stub webhook receiver")
+    parser.add_argument("--port", type=int, default=9000)
+    args = parser.parse_args()
+    ThreadingHTTPServer(("127.0.0.1", args.port), StubReceiver).serve_forever()
@@ -0,0 +1,145 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+# Response headers worth keeping with a fixture
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+
+def fixture_name(url):
+    parts = urlsplit(url)
+    return os.path.join(parts.netloc, hashlib.sha1(url.encode("utf-8")).hexdigest()[:20])
+
+
+def save_fixture(directory, url, body, headers=None):
+    # A fixture is the raw body plus a small JSON sidecar with the URL it came from and its validators
+    path = os.path.join(directory, fixture_name(url))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".body", "wb") as f:
+        f.write(body)
+    meta = {"url": url, "headers": {key: value for key, value in (headers or {}).items() if key in KEPT_HEADERS}}
+    with open(path + ".json", "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def load_fixture(directory, url):
+    path = os.path.join(directory, fixture_name(url))
+    try:
+        with open(path + ".json") as f:
+            meta = json.load(f)
+        with open(path + ".body", "rb") as f:
+            return meta["headers"], f.read()
+    except FileNotFoundError:
+        return None
+
+
+def replay_path(url):
+    # https://host/path?q is served by the stand-in as /https/host/path?q
+    parts = urlsplit(url)
+    return f"/{parts.scheme}/{parts.netloc}{parts.path or '/'}" + (f"?{parts.query}" if parts.query else "")
+
+
+def original_url(path):
+    scheme, _, rest = path.lstrip("/").partition("/")
+    return f"{scheme}://{rest}"
+
+
+class ReplayServer(ThreadingHTTPServer):
+    # A local stand-in for every upstream we scrape. Responses come from `fixtures` (url -> (headers, body)),
+    # falling back to recorded files in each of `directories` in turn. Bytes served are counted per URL for the
+    # benchmarks and published at /__stats__.
+    daemon_threads = True
+
+    def __init__(self, address, directories=(), fixtures=None):
+        super().__init__(address, ReplayHandler)
+        self.directories = list(directories)
+        self.fixtures = dict(fixtures or {})
+        self.bytes_served = {}
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def lookup(self, url):
+        if url in self.fixtures:
+            return self.fixtures[url]
+        for directory in self.directories:
+            found = load_fixture(directory, url)
+            if found is not None:
+                return found
+        return None
+
+    def handle_error(self, request, client_address):
+        # Scrapers that stream hang up as soon as they have what they need
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+    def count(self, url, size):
+        with self.lock:
+            self.bytes_served[url] = self.bytes_served.get(url, 0) + size
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/__stats__":
+            with self.server.lock:
+                body = json.dumps(self.server.bytes_served).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        url = original_url(self.path)
+        found = self.server.lookup(url)
+        if found is None:
+            self.send_error(404, f"No fixture for {url}")
+            return
+        headers, body = found
+
+        etag = headers.get("ETag")
+        if etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(url, len(body))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(directories=(), fixtures=None, host="127.0.0.1", port=0) -> ReplayServer:
+    server = ReplayServer((host, port), directories, fixtures)
+    threading.Thread(target=server.serve_forever, name="replay-server", daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve recorded scraper fixtures from a local stand-in server. "
+                                                 "Point VERSIONS_REPLAY_URL at it to run every scraper offline.")
+    parser.add_argument("--fixtures", action="append", help="fixture directory; may be repeated, first match wins")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    directories = args.fixtures or ["fixtures"]
+    server = ReplayServer(("127.0.0.1", args.port), directories)
+    print(f"Replaying {', '.join(directories)} on {server.base_url}", flush=True)
+    server.serve_forever()
@@ -0,0 +1,334 @@
+import gzip
+import hashlib
+import io
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import http_client
+import metrics
+
+DEB_BASEURL = "https://downloads.1password.com/linux/debian"
+RPM_BASEURL = "https://downloads.1password.com/linux/rpm"
+
+
+class Target(NamedTuple):
+    source_id: str
+    browser: str
+    format: str    # 'deb' or 'rpm'
+    arch: str      # Debian architecture for deb (amd64, arm64), basearch for rpm (x86_64, aarch64)
+    channel: str   # 'stable' or 'beta'
+    name: str      # what the dashboard calls it
+    package: str = "1password"
+
+
+# Every Linux package we track. Targets that share an index are fetched and parsed together, once.
+TARGETS = (
+    Target('opl_deb_stable', 'opl_deb', 'deb', 'amd64', 'stable', 'Linux (deb)'),
+    Target('opl_deb_arm64_stable', 'opl_deb_arm64', 'deb', 'arm64', 'stable', 'Linux (deb, arm64)'),
+    Target('opl_deb_beta', 'opl_deb', 'deb', 'amd64', 'beta', 'Linux (deb)'),
+    Target('opl_deb_arm64_beta', 'opl_deb_arm64', 'deb', 'arm64', 'beta', 'Linux (deb, arm64)'),
+    Target('opl_rpm_stable', 'opl_rpm', 'rpm', 'x86_64', 'stable', 'Linux (rpm)'),
+    Target('opl_rpm_aarch64_stable', 'opl_rpm_aarch64', 'rpm', 'aarch64', 'stable', 'Linux (rpm, aarch64)'),
+    Target('opl_rpm_beta', 'opl_rpm', 'rpm', 'x86_64', 'beta', 'Linux (rpm)'),
+    Target('opl_rpm_aarch64_beta', 'opl_rpm_aarch64', 'rpm', 'aarch64', 'beta', 'Linux (rpm, aarch64)'),
+)
+
+
+def index_key(target) -> str:
+    return f"{target.format}:{target.channel}:{target.arch}"
+
+
+class _HashingReader:
+    # Wraps a file-like object and hashes every byte read through it
+
+    def __init__(self, fileobj, algorithm="sha256"):
+        self._fileobj = fileobj
+        self._hash = hashlib.new(algorithm)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self._hash.update(data)
+        self.bytes_read += len(data)
+        return data
+
+    def drain(self):
+        while self.read(64 * 1024):
+            pass
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+def _strip_ns(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1] if "}" in tag else tag
+
+
+def compare_evr(a, b) -> int:
+    # The version comparison libraries are only loaded once a repo index is actually being read
+    from rpm_vercmp import vercmp
+
+    ea, va, ra = a
+    eb, vb, rb = b
+
+    ea = int(ea or 0)
+    eb = int(eb or 0)
+    if ea != eb:
+        return -1 if ea < eb else 1
+
+    c = vercmp(va or "", vb or "")
+    if c != 0:
+        return c
+
+    return vercmp(ra or "", rb or "")
+
+
+def _release_sha256(release_text, path):
+    # Find the SHA256 a Debian (In)Release file lists for one of its index files
+    in_sha256 = False
+    for line in release_text.splitlines():
+        if not line.startswith(" "):
+            in_sha256 = line.startswith("SHA256:")
+            continue
+        if in_sha256:
+            fields = line.split()
+            if len(fields) == 3 and fields[2] == path:
+                return fields[0]
+    return None
+
+
+def _cached_versions(cached, fingerprint, packages):
+    # The cached answer is good if the index is byte-for-byte the same and it covers every package we want
+    if not cached or not fingerprint or cached.get("fingerprint") != fingerprint:
+        return None
+    versions = cached.get("versions") or {}
+    if not packages <= versions.keys():
+        return None
+    return versions
+
+
+def parse_packages(lines, packages) -> dict:
+    # One pass over a Debian Packages file, keeping the newest version of every package we track. The best
+    # version so far is kept parsed, so each candidate costs one Version object rather than two.
+    from debian import debian_support
+
+    best = {}
+    current = None
+
+    for line in lines:
+        line = line.rstrip("\n")
+
+        # Blank line = end of stanza
+        if not line:
+            current = None
+            continue
+
+        if line.startswith("Package:"):
+            name = line.split(":", 1)[1].strip()
+            current = name if name in packages else None
+            continue
+
+        if current is not None and line.startswith("Version:"):
+            v = line.split(":", 1)[1].strip()
+            held = best.get(current)
+            if held is not None and v == held[1]:
+                continue
+            candidate = debian_support.Version(v)
+            if held is None or candidate > held[0]:
+                best[current] = (candidate, v)
+
+    return {name: v for name, (_, v) in best.items()}
+
+
+def parse_primary(fileobj, packages) -> dict:
+    # One streaming pass over an rpm primary.xml, keeping the newest (epoch, version, release) of every package
+    # we track. Each package is dropped from the tree as soon as it's been read, so memory stays flat however
+    # big the repo gets.
+    best = {}
+    metadata = None
+    in_package = False
+    name = None
+    evr = None
+
+    for event, elem in ET.iterparse(fileobj, events=("start", "end")):
+        tag = _strip_ns(elem.tag)
+        if event == "start":
+            if metadata is None:
+                metadata = elem
+            elif tag == "package":
+                in_package = True
+                name = None
+                evr = None
+            continue
+
+        if not in_package:
+            continue
+        if tag == "name" and name is None:
+            name = (elem.text or "").strip()
+        elif tag == "version" and name in packages:
+            evr = (
+                elem.attrib.get("epoch", "0"),
+                elem.attrib.get("ver", ""),
+                elem.attrib.get("rel", ""),
+            )
+        elif tag == "package":
+            in_package = False
+            if name in packages and evr:
+                held = best.get(name)
+                if held is None or compare_evr(evr, held) > 0:
+                    best[name] = evr
+            metadata.clear()
+
+    return best
+
+
+def _fetch_deb(arch, channel, packages, cached, timeout):
+    dist_url = f"{DEB_BASEURL}/{arch}/dists/{channel}"
+    index_path = f"main/binary-{arch}/Packages.gz"
+
+    # InRelease is a few KB and carries the SHA256 of Packages.gz, so it tells us whether there's anything new
+    expected_sha256 = None
+    try:
+        release = http_client.get(f"{dist_url}/InRelease", timeout=timeout)
+        if release.status_code == 200:
+            expected_sha256 = _release_sha256(release.text, index_path)
+    except Exception:
+        pass
+
+    versions = _cached_versions(cached, expected_sha256, packages)
+    if versions is not None:
+        return versions, cached
+
+    # Without a Release checksum, fall back to revalidating Packages.gz with its ETag / Last-Modified
+    headers = {}
+    if not expected_sha256 and cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    request = http_client.get(f"{dist_url}/{index_path}", stream=True, timeout=timeout, headers=headers)
+    if request.status_code == 304:
+        versions = _cached_versions(cached, cached.get("fingerprint") if cached else None, packages)
+        if versions is not None:
+            return versions, cached
+        request = http_client.get(f"{dist_url}/{index_path}", stream=True, timeout=timeout)
+    request.raise_for_status()
+    request.raw.decode_content = True
+
+    # Stream gzip -> text lines
+    raw = _HashingReader(request.raw)
+    gz = gzip.GzipFile(fileobj=raw)
+    lines = io.TextIOWrapper(gz, encoding="utf-8", errors="replace")
+    with metrics.PARSE_SECONDS.time(source=metrics.current_source()):
+        versions = parse_packages(lines, packages)
+    # The parser reads to the end, so the gzip position is the size of the whole decompressed index
+    metrics.PARSED_BYTES.inc(gz.tell(), source=metrics.current_source())
+
+    raw.drain()
+    request.close()
+    http_client.count_downloaded(f"{dist_url}/{index_path}", raw.bytes_read)
+    if expected_sha256 and raw.hexdigest() != expected_sha256:
+        raise ValueError(f"{index_path} checksum mismatch")
+
+    return versions, {
+        "fingerprint": expected_sha256 or raw.hexdigest(),
+        "etag": request.headers.get("ETag"),
+        "last_modified": request.headers.get("Last-Modified"),
+        "versions": versions,
+    }
+
+
+def _fetch_rpm(basearch, channel, packages, cached, timeout):
+    repo_url = f"{RPM_BASEURL}/{channel}/{basearch}"
+
+    # repomd.xml
+    r = http_client.get(f"{repo_url}/repodata/repomd.xml", timeout=timeout)
+    r.raise_for_status()
+    root = ET.fromstring(r.content)
+
+    primary_href = None
+    primary_checksum = None
+    for data in root.iter():
+        if _strip_ns(data.tag) == "data" and data.attrib.get("type") == "primary":
+            for child in data.iter():
+                tag = _strip_ns(child.tag)
+                if tag == "location":
+                    primary_href = child.attrib.get("href")
+                elif tag == "checksum":
+                    primary_checksum = (child.attrib.get("type", "sha256"), (child.text or "").strip())
+            break
+
+    if not primary_href:
+        raise LookupError("primary metadata not found")
+
+    # If primary.xml.gz hasn't changed since the last run, neither has the answer
+    fingerprint = ":".join(primary_checksum) if primary_checksum else None
+    versions = _cached_versions(cached, fingerprint, packages)
+    if versions is not None:
+        return versions, cached
+
+    # primary.xml.gz, streamed straight from the socket through gzip into the XML parser
+    r = http_client.get(f"{repo_url}/{primary_href}", stream=True, timeout=timeout)
+    r.raise_for_status()
+    r.raw.decode_content = True
+
+    raw = _HashingReader(r.raw, primary_checksum[0] if primary_checksum else "sha256")
+    gz = gzip.GzipFile(fileobj=raw)
+    with metrics.PARSE_SECONDS.time(source=metrics.current_source()):
+        best = parse_primary(gz, packages)
+    metrics.PARSED_BYTES.inc(gz.tell(), source=metrics.current_source())
+
+    # Make sure what we parsed is what repomd.xml promised before we cache anything against its checksum
+    raw.drain()
+    r.close()
+    http_client.count_downloaded(f"{repo_url}/{primary_href}", raw.bytes_read)
+    if primary_checksum and raw.hexdigest() != primary_checksum[1]:
+        raise ValueError("primary.xml.gz checksum mismatch")
+
+    # We report the upstream version, as we always have; the release is only used to order builds
+    versions = {name: evr[1] for name, evr in best.items()}
+    return versions, {"fingerprint": fingerprint, "versions": versions}
+
+
+def _fetch_index(key, fetch, *args):
+    # Each index is its own source as far as the metrics go, so a growing one stands out
+    with metrics.source_scope(f"repo_index:{key}"):
+        return fetch(*args)
+
+
+def fetch_versions(targets, cached=None, timeout=10.0):
+    # Fetch every index the targets need exactly once, concurrently, and pull all of their packages out of it
+    # in a single pass. `cached` maps index_key() to what the last run returned for that index.
+    # Returns ({source_id: version or the exception that stopped it}, {index_key: cache entry}).
+    cached = cached or {}
+    groups = {}
+    for target in targets:
+        groups.setdefault(index_key(target), []).append(target)
+    if not groups:
+        return {}, {}
+
+    results = {}
+    new_cache = {}
+    with ThreadPoolExecutor(max_workers=min(8, len(groups)), thread_name_prefix='repo-index') as executor:
+        futures = {}
+        for key, group in groups.items():
+            fetch = _fetch_deb if group[0].format == "deb" else _fetch_rpm
+            packages = {target.package for target in group}
+            futures[key] = executor.submit(_fetch_index, key, fetch, group[0].arch, group[0].channel, packages,
+                                           cached.get(key), timeout)
+
+        for key, future in futures.items():
+            try:
+                versions, entry = future.result()
+            except Exception as e:
+                for target in groups[key]:
+                    results[target.source_id] = e
+                continue
+            new_cache[key] = entry
+            for target in groups[key]:
+                version = versions.get(target.package)
+                results[target.source_id] = version or LookupError(f"Package '{target.package}' not found")
+
+    return results, new_cache
@@ -0,0 +1,206 @@
+import argparse
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+import streamlit as st
+from sqlalchemy import text
+
+import db
+import functions as func
+import metrics
+import notify
+import snapshot
+
+# How often the worker wakes up to see whether anything needs refreshing (seconds)
+POLL_INTERVAL = 60
+# How long a worker may hold the refresh lease before another one is allowed to take over (seconds).
+# This needs to comfortably outlast scrape_all()'s overall deadline.
+LEASE_SECONDS = 300
+
+# Failing sources are retried after RETRY_BASE seconds, doubling with every consecutive failure up to MAX_BACKOFF
+RETRY_BASE = 300
+MAX_BACKOFF = 6 * 3600
+# How often old check heartbeats are rolled up and expired (seconds)
+COMPACTION_INTERVAL = 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_worker_lock = threading.Lock()
+_worker_thread = None
+_metrics_server = None
+_stop_event = threading.Event()
+
+
+@metrics.timed_db('acquire_lease')
+def acquire_lease(owner=WORKER_ID, seconds=LEASE_SECONDS) -> bool:
+    # A single conditional UPDATE is atomic in SQLite, so only one worker can win an expired lease
+    now = time.time()
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        result = s.execute(text(
+            "UPDATE refresh_lease SET owner = :owner, expires = :expires "
+            "WHERE name = 'refresh' AND (expires < :now OR owner = :owner);"),
+            {"owner": owner, "expires": now + seconds, "now": now}, )
+        s.commit()
+    return result.rowcount == 1
+
+
+@metrics.timed_db('release_lease')
+def release_lease(owner=WORKER_ID):
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        s.execute(text("UPDATE refresh_lease SET expires = 0 WHERE name = 'refresh' AND owner = :owner;"),
+                  {"owner": owner}, )
+        s.commit()
+
+
+@metrics.timed_db('init_schedule')
+def init_schedule():
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        # Scrapers that no longer exist (renamed or split into batches) would otherwise linger
+        known = [row[0] for row in s.execute(text('SELECT id FROM source_schedule;')).all()]
+        retired = [{"id": scraper_id} for scraper_id in known if scraper_id not in func.SCRAPERS]
+        if retired:
+            s.execute(text('DELETE FROM source_schedule WHERE id = :id;'), retired)
+        for scraper_id in func.SCRAPERS:
+            s.execute(text(
+                """INSERT INTO source_schedule (id, next_due, failures)
+                   SELECT :id, 0, 0
+                   WHERE NOT EXISTS (SELECT 1 FROM source_schedule WHERE id = :id);"""),
+                {"id": scraper_id}, )
+        s.commit()
+
+
+@metrics.timed_db('due_sources')
+def due_sources(now=None) -> list:
+    now = time.time() if now is None else now
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        rows = s.execute(text('SELECT id FROM source_schedule WHERE next_due <= :now;'), {"now": now}).all()
+    return [row[0] for row in rows if row[0] in func.SCRAPERS]
+
+
+@metrics.timed_db('breaker_probes')
+def breaker_probes(scraper_ids) -> set:
+    # The due scrapers whose breaker is open, so this run is their probe
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        rows = s.execute(text('SELECT id FROM source_schedule WHERE failures >= :threshold;'),
+                         {"threshold": func.BREAKER_THRESHOLD}).all()
+    return {row[0] for row in rows} & set(scraper_ids)
+
+
+def next_delay(scraper_id, failures) -> float:
+    interval = func.SCRAPERS[scraper_id].interval
+    if failures == 0:
+        # A little jitter stops every source falling due in the same tick forever
+        return interval * random.uniform(0.9, 1.1)
+    # Exponential backoff with "equal jitter", capped so a dead source is still retried a few times a day
+    backoff = min(RETRY_BASE * 2 ** (failures - 1), MAX_BACKOFF)
+    return random.uniform(backoff / 2, backoff)
+
+
+@metrics.timed_db('update_schedule')
+def update_schedule(scraper_ids, results, probes=()):
+    # A scraper succeeded this round if every source it fills came back with a version
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        failures = dict(s.execute(text('SELECT id, failures FROM source_schedule;')).all())
+        updates = []
+        for scraper_id in scraper_ids:
+            succeeded = all(not isinstance(results.get(source_id), (Exception, type(None)))
+                            for source_id in func.SCRAPERS[scraper_id].rows)
+            scraper_failures = 0 if succeeded else (failures.get(scraper_id) or 0) + 1
+            if succeeded and scraper_id in probes:
+                # The breaker closes; the full run it skipped happens on the next tick
+                next_due = time.time()
+            else:
+                next_due = time.time() + next_delay(scraper_id, scraper_failures)
+            updates.append({"next_due": next_due, "failures": scraper_failures, "id": scraper_id})
+        if updates:
+            s.execute(text('UPDATE source_schedule SET next_due = :next_due, failures = :failures WHERE id = :id;'),
+                      updates, )
+            # Breaker state is shown alongside the versions, so readers need to reload
+            db.bump_generation(s)
+        s.commit()
+
+
+def refresh_once() -> list:
+    # Refresh only the sources that are due, and only if nobody else is already doing it
+    if not due_sources():
+        return []
+    if not acquire_lease():
+        return []
+    try:
+        # Look again now the lease is ours: another worker may have refreshed them and released it in between
+        scraper_ids = due_sources()
+        if not scraper_ids:
+            return []
+        probes = breaker_probes(scraper_ids)
+        results = func.scrape_all(scraper_ids, probes=probes)
+        update_schedule(scraper_ids, results, probes)
+    finally:
+        release_lease()
+        snapshot.invalidate()
+        notify.publish()
+    return scraper_ids
+
+
+def run_forever(poll_interval=POLL_INTERVAL):
+    func.init_db()
+    init_schedule()
+    last_compaction = 0
+    while not _stop_event.is_set():
+        try:
+            refresh_once()
+        except Exception:
+            logger.exception("Refresh failed")
+        if time.time() - last_compaction > COMPACTION_INTERVAL:
+            try:
+                db.compact_history()
+                last_compaction = time.time()
+            except Exception:
+                logger.exception("History compaction failed")
+        _stop_event.wait(poll_interval)
+
+
+def start_background_refresh():
+    # Start one refresh worker per process. Setting VERSIONS_INPROCESS_REFRESH=0 leaves the
+    # schedule to a separate `python scheduler.py` process instead.
+    global _worker_thread
+    if os.environ.get('VERSIONS_INPROCESS_REFRESH', '1') == '0':
+        return
+    global _metrics_server
+    with _worker_lock:
+        if _worker_thread is None or not _worker_thread.is_alive():
+            _worker_thread = threading.Thread(target=run_forever, name='refresh-worker', daemon=True)
+            _worker_thread.start()
+        # The worker's scrape metrics live in this process, so VERSIONS_METRICS_PORT publishes them from here
+        metrics_port = os.environ.get('VERSIONS_METRICS_PORT')
+        if metrics_port and _metrics_server is None:
+            _metrics_server = metrics.start_server(port=int(metrics_port))
+    notify.start_dispatcher()
+
+
+def stop_background_refresh():
+    _stop_event.set()
+    notify.stop_dispatcher()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Refresh worker: scrapes every source when it falls due")
+    parser.add_argument("--metrics-port", type=int, default=9101, help="serve /metrics on this port (0 to disable)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.metrics_port:
+        metrics.start_server(port=args.metrics_port)
+    notify.start_dispatcher()
+    run_forever()
@@ -0,0 +1,156 @@
+import threading
+import time
+from typing import NamedTuple
+
+import streamlit as st
+from sqlalchemy import text
+
+import functions as func
+import metrics
+import sources
+import versioning
+
+# How each source's version strings are read when they're compared
+VERSION_FORMATS = {source.id: source.version_format for source in sources.SOURCES}
+
+# How often a render may ask the database whether another process has written a refresh (seconds)
+GENERATION_CHECK_INTERVAL = 5.0
+
+
+class Record(NamedTuple):
+    id: str
+    platform: str
+    browser: str
+    channel: str
+    version: str
+    success_check: float
+    fail_check: float
+    error_message: str
+
+    @property
+    def healthy(self):
+        return self.success_check > self.fail_check
+
+    @property
+    def stale(self):
+        # Failing, so the version shown is the last one we saw rather than a current one
+        return not self.healthy and self.success_check > 0
+
+
+class RegionRecord(NamedTuple):
+    source_id: str
+    region: str
+    version: str
+    success_check: float
+    fail_check: float
+    error_message: str
+
+    @property
+    def healthy(self):
+        return self.success_check > self.fail_check
+
+
+class Snapshot(NamedTuple):
+    # Bumped by every refresh that writes to the versions table
+    generation: int
+    records: tuple
+    by_id: dict
+    by_platform: dict
+    # source id -> its RegionRecords, for sources checked in several storefronts
+    regions: dict
+    # source id -> when the open circuit breaker skipping it will next be probed
+    paused: dict
+    # source id -> versioning.Standing against the newest version on its platform and channel, and the same
+    # grouped for the API; both worked out once per generation
+    standings: dict
+    matrix: list
+
+    def platform(self, platform):
+        return self.by_platform.get(platform, ())
+
+    def source_regions(self, source_id):
+        return self.regions.get(source_id, ())
+
+
+_lock = threading.Lock()
+_generation = None
+_checked_at = 0.0
+_stale = True
+
+
+def current_generation(s):
+    return s.execute(text("SELECT value FROM meta WHERE key = 'generation';")).scalar() or 0
+
+
+@metrics.timed_db('read_generation')
+def read_generation():
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        return current_generation(s)
+
+
+# Keyed on the generation, so a refresh naturally moves readers on to a new entry and the old one ages out.
+# cache_resource hands back the same object every time rather than a copy, which is what we want for a
+# read-only snapshot shared by every session.
+@st.cache_resource(max_entries=2)
+@metrics.timed_db('load_snapshot')
+def load_snapshot(generation) -> Snapshot:
+    # The whole table in one query, straight into tuples
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        rows = s.execute(text(
+            'SELECT id, platform, browser, channel, version, success_check, fail_check, error_message '
+            'FROM versions ORDER BY rowid;')).all()
+        region_rows = s.execute(text(
+            'SELECT source_id, region, version, success_check, fail_check, error_message '
+            'FROM region_versions ORDER BY source_id, region;')).all()
+        breakers = s.execute(text('SELECT id, next_due FROM source_schedule WHERE failures >= :threshold;'),
+                             {"threshold": func.BREAKER_THRESHOLD}).all()
+    records = tuple(Record(*row) for row in rows)
+    regions = {}
+    for row in region_rows:
+        regions.setdefault(row[0], []).append(RegionRecord(*row))
+    standings = versioning.standings(records, VERSION_FORMATS)
+    paused = {source_id: next_due for scraper_id, next_due in breakers if scraper_id in func.SCRAPERS
+              for source_id in func.SCRAPERS[scraper_id].rows}
+    by_platform = {}
+    for record in records:
+        by_platform.setdefault(record.platform, []).append(record)
+    return Snapshot(generation, records, {record.id: record for record in records},
+                    {platform: tuple(group) for platform, group in by_platform.items()},
+                    {source_id: tuple(group) for source_id, group in regions.items()}, paused,
+                    standings, versioning.matrix(records, standings))
+
+
+def get_snapshot() -> Snapshot:
+    # Serve the cached snapshot until a refresh writes something new. A refresh in this process marks the
+    # generation stale directly; one in another process is noticed by re-reading the counter every few seconds.
+    global _generation, _checked_at, _stale
+    with _lock:
+        now = time.monotonic()
+        if _stale or _generation is None or now - _checked_at >= GENERATION_CHECK_INTERVAL:
+            _generation = read_generation()
+            _checked_at = now
+            _stale = False
+        generation = _generation
+    return load_snapshot(generation)
+
+
+def invalidate():
+    global _stale
+    with _lock:
+        _stale = True
+
+
+def collect_metrics():
+    # Health gauges come from the database, so every process serving /metrics agrees on them whichever one
+    # did the scraping
+    versions = get_snapshot()
+    for record in versions.records:
+        metrics.LAST_SUCCESS.set(record.success_check, source=record.id)
+        metrics.LAST_FAILURE.set(record.fail_check, source=record.id)
+        metrics.HEALTHY.set(int(record.healthy), source=record.id)
+        metrics.BREAKER_OPEN.set(int(record.id in versions.paused), source=record.id)
+
+
+metrics.register_collector(collect_metrics)
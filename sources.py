@@ -0,0 +1,371 @@
+import contextvars
+import hashlib
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, NamedTuple
+
+import browser_pool
+import http_client
+import metrics
+import repo_index
+
+
+class Source(NamedTuple):
+    id: str
+    platform: str
+    browser: str
+    channel: str
+    # Name of the fetch strategy in FETCHERS that looks this source up
+    fetcher: str
+    # What the fetcher needs to find it: a URL, an App Store trackId or a repo_index.Target
+    target: object
+    # Where the version lives in a JSON response
+    path: tuple = ('version',)
+    # Storefronts to check it in, as lower-case country codes filled into {region} / {REGION} in the target.
+    # The first is the version the source itself reports; the rest are kept per region to follow staged rollouts.
+    regions: tuple = ()
+    # How to read its version strings when comparing across platforms (see versioning.parse)
+    version_format: str = 'dotted'
+    # What the dashboard calls it
+    name: str = ''
+
+
+class Fetcher(NamedTuple):
+    # Called with a list of sources and a timeout, returns {source id: version, or the exception that stopped it}
+    run: Callable
+    # The longest we're prepared to wait for one run (seconds)
+    timeout: float
+    # How often its sources should be re-checked when they're healthy (seconds)
+    interval: float
+    # Batched fetchers look all of their sources up in one go; the rest run once per source
+    batched: bool = False
+    # Splits a batched fetcher's sources into batches that are scheduled, backed off and broken separately,
+    # so one failing batch doesn't hold back the rest. Called with a source, returns its batch name.
+    batch_by: Callable = None
+    # Cached fetchers are also handed the source cache as read before the refresh ({key: entry}), and return
+    # (results, {key: changed entry}). The changes are written along with the results, in the same transaction.
+    cached: bool = False
+
+
+# Storefronts watched for staged rollouts, the one each source has always been checked in first
+STORE_REGIONS = ('us', 'gb', 'ca', 'au', 'nz', 'ie', 'de', 'fr', 'nl', 'be', 'ch', 'at', 'es', 'it', 'se', 'no', 'dk',
+                 'fi', 'pl', 'jp', 'kr', 'in', 'sg', 'br', 'mx')
+# Every Play Store storefront is a page rendered in a browser, so it gets a shorter list
+PLAY_REGIONS = ('us', 'gb', 'de', 'fr', 'jp', 'in', 'br', 'au')
+# Storefronts fetched at once for one source; http_client's per-host limits still apply on top
+REGION_WORKERS = 8
+# A regional fan-out stops waiting at this share of its fetcher's timeout and reports the storefronts it has,
+# so a slow one never costs the source the versions that did come back
+REGION_DEADLINE_SHARE = 0.8
+
+
+def _dig(document, path):
+    for key in path:
+        document = document[key]
+    return document
+
+
+# The shortcut past the full parse: an element whose whole text is "Version", then the text of the next element
+# (through any tags it opens first), which has to look like a version number to be believed
+_VERSION_LABEL = re.compile(rb'>Version<')
+_NEXT_ELEMENT_TEXT = re.compile(rb'<[A-Za-z][^>]*>(?:\s*<[A-Za-z][^>]*>)*\s*([^<]+?)\s*<')
+_VERSION_NUMBER = re.compile(r'\d+(?:\.\d+)+')
+# How much of a page is read between scans when streaming it (bytes)
+SCAN_CHUNK = 64 * 1024
+
+
+def _scan_version(html, start=0):
+    # Returns (version or None, where to resume scanning once more of the page has arrived)
+    label = _VERSION_LABEL.search(html, start)
+    if label is None:
+        return None, max(0, len(html) - len(_VERSION_LABEL.pattern))
+    match = _NEXT_ELEMENT_TEXT.search(html, label.end() - 1)
+    if match:
+        text = match.group(1).decode('utf-8', errors='replace')
+        if _VERSION_NUMBER.fullmatch(text):
+            return text, label.start()
+    return None, label.start()
+
+
+def _version_after_label(html):
+    # The version number appears right *after* the "Version" text
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    version_element = soup.find(string="Version")
+    if version_element:
+        nxt = version_element.find_next()
+        if nxt:
+            return nxt.get_text(strip=True) or None
+    return None
+
+
+def _regional_url(url, region):
+    return url.format(region=region, REGION=region.upper())
+
+
+def _region_deadline(timeout):
+    return time.monotonic() + timeout * REGION_DEADLINE_SHARE
+
+
+def _time_left(deadline):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("ran out of time")
+    return remaining
+
+
+def _fetch_regions(source_id, regions, fetch_body, parse, deadline):
+    # Fetch every storefront at once and return {region: version or the exception that stopped it}. The first
+    # region, the one the source reports, is started first. Whatever hasn't come back by `deadline` is reported as
+    # a timeout and the rest still count. Most storefronts serve byte-identical responses most of the time, so each
+    # distinct body is only parsed once.
+    executor = ThreadPoolExecutor(max_workers=min(REGION_WORKERS, len(regions)), thread_name_prefix='region')
+    futures = {region: executor.submit(contextvars.copy_context().run, fetch_body, region) for region in regions}
+    wait(futures.values(), timeout=max(0.0, deadline - time.monotonic()))
+    # Storefronts still queued never start; running ones are bounded by the deadline they were given
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    parsed = {}
+    results = {}
+    for region, future in futures.items():
+        if not future.done() or future.cancelled():
+            results[region] = TimeoutError(f"storefront {region} didn't answer in time")
+            continue
+        try:
+            body = future.result()
+        except Exception as e:
+            results[region] = e
+            continue
+        digest = hashlib.sha1(body).digest()
+        if digest not in parsed:
+            try:
+                metrics.PARSED_BYTES.inc(len(body), source=source_id)
+                with metrics.PARSE_SECONDS.time(source=source_id):
+                    parsed[digest] = parse(body)
+            except Exception as e:
+                parsed[digest] = e
+        results[region] = parsed[digest]
+    return results
+
+
+def fetch_json(sources, timeout):
+    results = {}
+    for source in sources:
+        if source.regions:
+            deadline = _region_deadline(timeout)
+
+            def fetch_body(region, source=source, deadline=deadline):
+                return http_client.get(_regional_url(source.target, region),
+                                       timeout=min(timeout, _time_left(deadline))).content
+
+            def parse(body, source=source):
+                return _dig(json.loads(body), source.path)
+
+            results[source.id] = _fetch_regions(source.id, source.regions, fetch_body, parse, deadline)
+            continue
+        try:
+            response = http_client.get(source.target, timeout=timeout)
+            metrics.PARSED_BYTES.inc(len(response.content), source=source.id)
+            with metrics.PARSE_SECONDS.time(source=source.id):
+                results[source.id] = _dig(response.json(), source.path)
+        except Exception as e:
+            results[source.id] = e
+    return results
+
+
+def fetch_app_store(sources, timeout):
+    # Every App Store product comes back from a single lookup request per storefront, so adding another costs
+    # nothing extra. Sources without regions share the lookup with no storefront set (None).
+    url = 'https://itunes.apple.com/lookup?id=' + ','.join(str(source.target) for source in sources)
+    regions = tuple(dict.fromkeys(region for source in sources for region in (source.regions or (None,))))
+    deadline = _region_deadline(timeout)
+
+    def fetch_body(region):
+        return http_client.get(url + (f'&country={region}' if region else ''),
+                               timeout=min(timeout, _time_left(deadline))).content
+
+    def parse(body):
+        return {result.get('trackId'): result for result in json.loads(body)['results']}
+
+    lookups = _fetch_regions(metrics.current_source(), regions, fetch_body, parse, deadline)
+
+    def version(source, found):
+        if isinstance(found, Exception):
+            return found
+        result = found.get(source.target)
+        if result is None:
+            return LookupError(f"App Store lookup returned no result for {source.target}")
+        return _dig(result, source.path)
+
+    results = {}
+    for source in sources:
+        if source.regions:
+            results[source.id] = {region: version(source, lookups[region]) for region in source.regions}
+        else:
+            results[source.id] = version(source, lookups[None])
+    return results
+
+
+def _find_version(html):
+    # The same for a page we already have in full
+    if isinstance(html, str):
+        html = html.encode('utf-8')
+    version, _ = _scan_version(html)
+    return version or _version_after_label(html)
+
+
+def _stream_version(url, source_id, timeout):
+    # Read the page only as far as the version. If the shortcut never finds one, fall back to parsing it all.
+    response = http_client.get(url, timeout=timeout, stream=True)
+    html = bytearray()
+    resume = 0
+    parse_seconds = 0.0
+    try:
+        for chunk in response.iter_content(SCAN_CHUNK):
+            html += chunk
+            started = time.perf_counter()
+            version, resume = _scan_version(html, resume)
+            parse_seconds += time.perf_counter() - started
+            if version:
+                return version
+        started = time.perf_counter()
+        version = _version_after_label(bytes(html))
+        parse_seconds += time.perf_counter() - started
+        return version
+    finally:
+        response.close()
+        http_client.count_downloaded(url, len(html))
+        metrics.PARSED_BYTES.inc(len(html), source=source_id)
+        metrics.PARSE_SECONDS.observe(parse_seconds, source=source_id)
+
+
+def fetch_html(sources, timeout):
+    results = {}
+    for source in sources:
+        try:
+            results[source.id] = _stream_version(source.target, source.id, timeout) or LookupError("Scrape failed.")
+        except Exception as e:
+            results[source.id] = e
+    return results
+
+
+def _remaining_ms(deadline):
+    # Playwright wants its timeouts in milliseconds, and each step only gets what's left of the job's time
+    return _time_left(deadline) * 1000
+
+
+def _play_store_page(url, deadline):
+    # `deadline` is a time.monotonic() value shared by every step, so the whole job, time spent queued for a
+    # browser included, never outlasts the timeout it was given
+    def job(context):
+        page = context.new_page()
+
+        page.goto(url, wait_until="domcontentloaded", timeout=_remaining_ms(deadline))
+
+        # Wait for the page to be interactive enough that the About button exists
+        about_btn = '[aria-label="See more information on About this app"]'
+        page.wait_for_selector(about_btn, timeout=_remaining_ms(deadline))
+
+        # Click "About this app" (your old JS click, but as a real click)
+        page.click(about_btn, timeout=_remaining_ms(deadline))
+
+        # Wait for the Version label to appear in the expanded content / dialog
+        page.wait_for_selector("text=Version", timeout=_remaining_ms(deadline))
+
+        # Pull the fully-rendered HTML after the click
+        return page.content()
+    return job
+
+
+def _play_store_html(url, timeout) -> bytes:
+    if http_client.REPLAY_URL:
+        # Offline, the recorded page stands in for the rendered one
+        return http_client.get(url, timeout=timeout).content
+    deadline = time.monotonic() + timeout
+    html = browser_pool.get_pool().run(_play_store_page(url, deadline), timeout=timeout).encode("utf-8")
+    http_client.record(url, html, {"Content-Type": "text/html; charset=utf-8"})
+    http_client.count_downloaded(url, len(html))
+    return html
+
+
+def _play_store_version(html):
+    return _find_version(html) or LookupError("Scrape failed: could not find Version text/value.")
+
+
+def fetch_play_store(sources, timeout):
+    results = {}
+    for source in sources:
+        if source.regions:
+            deadline = _region_deadline(timeout)
+
+            def fetch_body(region, source=source, deadline=deadline):
+                return _play_store_html(_regional_url(source.target, region), _time_left(deadline))
+
+            results[source.id] = _fetch_regions(source.id, source.regions, fetch_body, _play_store_version,
+                                                deadline)
+            continue
+        try:
+            html = _play_store_html(source.target, timeout)
+            metrics.PARSED_BYTES.inc(len(html), source=source.id)
+            with metrics.PARSE_SECONDS.time(source=source.id):
+                results[source.id] = _play_store_version(html)
+        except Exception as e:
+            results[source.id] = e
+    return results
+
+
+def fetch_repo_index(sources, timeout, cache):
+    # Every deb and rpm target comes out of one pass over each repository index it lives in
+    targets = [source.target for source in sources]
+    keys = {repo_index.index_key(target) for target in targets}
+    cached = {key: cache.get(f"repo_index:{key}") for key in keys}
+    results, new_cache = repo_index.fetch_versions(targets, cached, min(timeout, 10.0))
+    return results, {f"repo_index:{key}": entry for key, entry in new_cache.items() if entry != cached.get(key)}
+
+
+def _repo_index_batch(source):
+    # Each repository index succeeds or fails on its own: a missing beta or aarch64 index mustn't back off the rest
+    return repo_index.index_key(source.target)
+
+
+# Cheap JSON APIs are polled often, the Play Store rarely. Regional sources fetch their storefronts concurrently
+# and report whichever answered within the timeout, so one slow storefront can't fail the whole source.
+FETCHERS = {
+    'json': Fetcher(fetch_json, 20, 1800),
+    'app_store': Fetcher(fetch_app_store, 20, 1800, batched=True),
+    'html': Fetcher(fetch_html, 20, 3600),
+    'play_store': Fetcher(fetch_play_store, 120, 21600),
+    'repo_index': Fetcher(fetch_repo_index, 60, 3600, batched=True, batch_by=_repo_index_batch,
+                          cached=True),
+}
+
+# Every product we track, in the order the dashboard shows them
+SOURCES = (
+    Source('chrome_stable', 'browser_extension', 'chrome', 'stable', 'html',
+           'https://chromewebstore.google.com/detail/1password-%E2%80%93-password-mana/aeblfdkhhhdcdjpifhhbdiojplfjncoa',
+           name='Chrome'),
+    Source('edge_stable', 'browser_extension', 'edge', 'stable', 'json',
+           'https://microsoftedge.microsoft.com/addons/getproductdetailsbycrxid/dppgmdbiimibapkepcbdbmkaabgiofem?hl=en-US&gl={REGION}',
+           regions=STORE_REGIONS, name='Edge'),
+    Source('firefox_stable', 'browser_extension', 'firefox', 'stable', 'json',
+           'https://addons.mozilla.org/api/v5/addons/addon/1password-x-password-manager/',
+           ('current_version', 'version'), name='Firefox'),
+    Source('safari_stable', 'browser_extension', 'safari', 'stable', 'app_store', 1569813296,
+           regions=STORE_REGIONS, name='Safari'),
+    Source('opi_stable', 'mobile', 'opi', 'stable', 'app_store', 1511601750, regions=STORE_REGIONS, name='iOS'),
+    Source('opa_stable', 'mobile', 'opa', 'stable', 'play_store',
+           'https://play.google.com/store/apps/details?id=com.onepassword.android&hl=en&gl={REGION}',
+           regions=PLAY_REGIONS, name='Android'),
+    Source('opw_stable', 'desktop', 'opw', 'stable', 'json',
+           'https://app-updates.agilebits.com/check/3/26.2.0/arm64/OPW8/en/8/ab/production/unkown',
+           name='Windows'),
+    Source('opm_stable', 'desktop', 'opm', 'stable', 'json',
+           'https://app-updates.agilebits.com/check/3/26.2.0/arm64/OPM8/en/8/ab/production/unkown',
+           name='macOS'),
+    *(Source(target.source_id, 'desktop', target.browser, target.channel, 'repo_index', target,
+             version_format=target.format, name=target.name)
+      for target in repo_index.TARGETS),
+)
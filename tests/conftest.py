@@ -0,0 +1,74 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app is a set of flat modules at the top of the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# st.connection('versions_db') reads its URL from .streamlit/secrets.toml in the working directory, so the suite
+# runs from a scratch directory with a throwaway SQLite database. This has to happen before streamlit is imported.
+_workdir = tempfile.mkdtemp(prefix="versions-tests-")
+os.makedirs(os.path.join(_workdir, ".streamlit"))
+with open(os.path.join(_workdir, ".streamlit", "secrets.toml"), "w") as f:
+    f.write(f'[connections.versions_db]\nurl = "sqlite:///{os.path.join(_workdir, "versions.db")}"\n')
+os.chdir(_workdir)
+os.environ["VERSIONS_INPROCESS_REFRESH"] = "0"
+
+
+@pytest.fixture
+def empty_db():
+    # The shared test database with every table dropped and the schema version reset
+    import streamlit as st
+    from sqlalchemy import text
+
+    conn = st.connection('versions_db', type='sql')
+    with conn.session as s:
+        tables = s.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%';")).scalars().all()
+        for table in tables:
+            s.execute(text(f'DROP TABLE "{table}";'))
+        s.execute(text('PRAGMA user_version = 0;'))
+        s.commit()
+    return conn
+
+
+@pytest.fixture
+def migrated_db(empty_db):
+    # A current schema with a row for every registered source
+    import db
+    import sources
+    from sqlalchemy import text
+
+    db.migrate()
+    with empty_db.session as s:
+        s.execute(text(
+            "INSERT INTO versions (id, platform, browser, channel) VALUES (:id, :platform, :browser, :channel);"),
+            [{"id": source.id, "platform": source.platform, "browser": source.browser, "channel": source.channel}
+             for source in sources.SOURCES], )
+        s.commit()
+    return empty_db
+
+
+@pytest.fixture
+def replay_server(monkeypatch):
+    # Start a stand-in server with `fixtures` ({url: (headers, body)}) or recorded `directories`, and route every
+    # request through it
+    import http_client
+    import replay
+
+    servers = []
+
+    def start(fixtures=None, directories=()):
+        server = replay.start_server(directories, fixtures)
+        servers.append(server)
+        monkeypatch.setattr(http_client, "REPLAY_URL", server.base_url)
+        http_client.clear_cache()
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+    http_client.clear_cache()
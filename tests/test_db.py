@@ -0,0 +1,65 @@
+from sqlalchemy import text
+
+import db
+
+
+def test_migrate_upgrades_the_original_all_text_table(empty_db):
+    with empty_db.session as s:
+        # The schema and data as the first version of the app left them: every column TEXT, no primary key
+        s.execute(text(db.MIGRATIONS[0][0]))
+        s.execute(text(
+            "INSERT INTO versions VALUES (:id, :platform, :browser, :channel, :version, :success_check, "
+            ":fail_check, :error_message);"),
+            [{"id": "chrome_stable", "platform": "browser_extension", "browser": "chrome", "channel": "stable",
+              "version": "8.11.22.27", "success_check": "1700000000.5", "fail_check": "",
+              "error_message": None},
+             {"id": "opa_stable", "platform": "mobile", "browser": "opa", "channel": "stable",
+              "version": None, "success_check": None, "fail_check": "1700000100",
+              "error_message": "Scrape failed."},
+             # A duplicate row, which the primary key has no room for
+             {"id": "chrome_stable", "platform": "browser_extension", "browser": "chrome", "channel": "stable",
+              "version": "8.11.20", "success_check": "1600000000", "fail_check": "", "error_message": ""}], )
+        s.execute(text('PRAGMA user_version = 1;'))
+        s.commit()
+
+    db.migrate()
+
+    with empty_db.session as s:
+        assert s.execute(text('PRAGMA user_version;')).scalar() == len(db.MIGRATIONS)
+        rows = s.execute(text(
+            'SELECT id, version, success_check, fail_check, error_message FROM versions ORDER BY rowid;')).all()
+        assert [tuple(row) for row in rows] == [
+            ('chrome_stable', '8.11.22.27', 1700000000.5, 0.0, ''),
+            ('opa_stable', '', 0.0, 1700000100.0, 'Scrape failed.'),
+        ]
+        assert s.execute(text('SELECT typeof(success_check) FROM versions LIMIT 1;')).scalar() == 'real'
+        # The timeline starts from the versions already known
+        history = s.execute(text('SELECT source_id, version, previous_version FROM version_history;')).all()
+        assert [tuple(row) for row in history] == [('chrome_stable', '8.11.22.27', None)]
+        assert s.execute(text("SELECT owner, expires FROM refresh_lease WHERE name = 'refresh';")).one() == ('', 0)
+
+
+def test_migrate_is_idempotent(empty_db):
+    db.migrate()
+    db.migrate()
+
+    with empty_db.session as s:
+        assert s.execute(text('PRAGMA user_version;')).scalar() == len(db.MIGRATIONS)
+        assert s.execute(text("SELECT COUNT(*) FROM refresh_lease;")).scalar() == 1
+
+
+def test_write_results_records_transitions_and_cache_in_one_go(migrated_db):
+    db.write_results({'chrome_stable': '8.11.20', 'firefox_stable': LookupError('gone')},
+                     cache={'repo_index:deb:stable:amd64': {'fingerprint': 'abc', 'versions': {}}})
+    db.write_results({'chrome_stable': '8.11.22'})
+    db.write_results({'chrome_stable': '8.11.22'})
+
+    events = db.events_since(0)
+    assert [(event['source_id'], event['version'], event['previous_version']) for event in events] == [
+        ('chrome_stable', '8.11.20', None),
+        ('chrome_stable', '8.11.22', '8.11.20'),
+    ]
+    with migrated_db.session as s:
+        row = s.execute(text("SELECT error_message FROM versions WHERE id = 'firefox_stable';")).scalar()
+    assert row == 'Scrape failed: LookupError: gone'
+    assert db.load_cache() == {'repo_index:deb:stable:amd64': {'fingerprint': 'abc', 'versions': {}}}
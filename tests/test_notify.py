@@ -0,0 +1,102 @@
+import json
+import socket
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+from sqlalchemy import text
+
+import db
+import notify
+
+
+@pytest.fixture
+def receiver():
+    # notify's own stub receiver, listening on a free local port
+    server = ThreadingHTTPServer(("127.0.0.1", 0), notify.StubReceiver)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/hook"
+    server.shutdown()
+    server.server_close()
+
+
+def cursor(conn, url):
+    with conn.session as s:
+        return s.execute(text('SELECT last_id, attempts, next_attempt FROM webhook_cursor WHERE url = :url;'),
+                         {"url": url}).one()
+
+
+def delivered(output):
+    return [json.loads(line) for line in output.splitlines() if line.startswith('{')]
+
+
+def test_new_subscriber_starts_from_now(migrated_db, receiver, capsys):
+    db.write_results({'chrome_stable': '8.11.20'})
+
+    notify.dispatch_once([receiver])
+
+    assert delivered(capsys.readouterr().out) == []
+    assert cursor(migrated_db, receiver).last_id == db.latest_event_id()
+
+
+def test_version_changes_are_delivered_in_order_once(migrated_db, receiver, capsys):
+    notify.dispatch_once([receiver])
+    db.write_results({'chrome_stable': '8.11.20', 'opw_stable': '8.11.18'})
+    db.write_results({'chrome_stable': '8.11.22'})
+
+    notify.dispatch_once([receiver])
+    notify.dispatch_once([receiver])
+
+    events = delivered(capsys.readouterr().out)
+    assert [(event['source_id'], event['version'], event['previous_version']) for event in events] == [
+        ('chrome_stable', '8.11.20', None),
+        ('opw_stable', '8.11.18', None),
+        ('chrome_stable', '8.11.22', '8.11.20'),
+    ]
+    assert cursor(migrated_db, receiver) == (events[-1]['id'], 0, 0)
+
+
+def test_failed_delivery_backs_off_without_moving_the_cursor(migrated_db):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        url = f"http://127.0.0.1:{sock.getsockname()[1]}/hook"
+    notify.dispatch_once([url])
+    start = cursor(migrated_db, url).last_id
+    db.write_results({'chrome_stable': '8.11.20'})
+
+    notify.dispatch_once([url])
+
+    last_id, attempts, next_attempt = cursor(migrated_db, url)
+    assert (last_id, attempts) == (start, 1)
+    assert next_attempt > time.time()
+
+
+def test_concurrent_dispatchers_deliver_each_event_once(migrated_db, monkeypatch):
+    received = []
+    lock = threading.Lock()
+
+    def deliver(url, event, timeout=10.0):
+        with lock:
+            received.append(event['id'])
+        time.sleep(0.02)
+
+    monkeypatch.setattr(notify, 'deliver', deliver)
+    url = 'http://receiver.example/hook'
+    notify.dispatch_once([url])
+    for version in ('8.11.18', '8.11.20', '8.11.22'):
+        db.write_results({'chrome_stable': version})
+
+    dispatchers = [threading.Thread(target=notify.dispatch_once, args=([url],)) for _ in range(3)]
+    for dispatcher in dispatchers:
+        dispatcher.start()
+    for dispatcher in dispatchers:
+        dispatcher.join()
+    # Whatever a losing dispatcher left undelivered is picked up on the next pass
+    for _ in range(3):
+        notify.dispatch_once([url])
+
+    assert received == sorted(set(received))
+    assert len(received) == 3
+    assert cursor(migrated_db, url).last_id == db.latest_event_id()
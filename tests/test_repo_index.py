@@ -0,0 +1,75 @@
+import gzip
+import io
+
+import repo_index
+
+PACKAGES = """\
+Package: 1password
+Version: 8.10.0-1
+Architecture: amd64
+
+Package: 1password-cli
+Version: 9.0.0-1
+Architecture: amd64
+
+Package: 1password
+Version: 1:8.9.0-1
+Architecture: amd64
+
+Package: 1password
+Version: 8.10.2~beta-1
+Architecture: amd64
+
+Package: 1password
+Version: 8.10.1-3
+Architecture: amd64
+"""
+
+PRIMARY = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="4">
+<package type="rpm"><name>1password</name><arch>x86_64</arch>
+  <version epoch="0" ver="8.10.0" rel="1"/><summary>1Password</summary></package>
+<package type="rpm"><name>1password-cli</name><arch>x86_64</arch>
+  <version epoch="0" ver="9.0.0" rel="1"/><summary>CLI</summary></package>
+<package type="rpm"><name>1password</name><arch>x86_64</arch>
+  <version epoch="0" ver="8.10.12" rel="1"/><summary>1Password</summary></package>
+<package type="rpm"><name>1password</name><arch>x86_64</arch>
+  <version epoch="0" ver="8.10.9" rel="7"/><summary>1Password</summary></package>
+</metadata>
+"""
+
+
+def test_parse_packages_keeps_the_newest_version_of_each_tracked_package():
+    # The epoch wins over any upstream version, and ~beta sorts before the release it precedes
+    assert repo_index.parse_packages(io.StringIO(PACKAGES), {'1password'}) == {'1password': '1:8.9.0-1'}
+
+
+def test_parse_packages_ignores_untracked_packages():
+    assert repo_index.parse_packages(io.StringIO(PACKAGES), {'1password-cli'}) == {'1password-cli': '9.0.0-1'}
+    assert repo_index.parse_packages(io.StringIO(PACKAGES), {'missing'}) == {}
+
+
+def test_parse_primary_compares_versions_numerically():
+    best = repo_index.parse_primary(io.BytesIO(PRIMARY.encode('utf-8')), {'1password'})
+
+    assert best == {'1password': ('0', '8.10.12', '1')}
+
+
+def test_parse_primary_streams_a_gzipped_index():
+    fileobj = gzip.GzipFile(fileobj=io.BytesIO(gzip.compress(PRIMARY.encode('utf-8'))))
+
+    best = repo_index.parse_primary(fileobj, {'1password', '1password-cli'})
+
+    assert best == {'1password': ('0', '8.10.12', '1'), '1password-cli': ('0', '9.0.0', '1')}
+
+
+def test_release_checksum_lookup():
+    release = ("Origin: 1Password\nSHA256:\n"
+               " aaaa 10 main/binary-arm64/Packages.gz\n"
+               " bbbb 20 main/binary-amd64/Packages.gz\n"
+               "SHA512:\n"
+               " cccc 20 main/binary-amd64/Packages.gz\n")
+
+    assert repo_index._release_sha256(release, 'main/binary-amd64/Packages.gz') == 'bbbb'
+    assert repo_index._release_sha256(release, 'main/binary-i386/Packages.gz') is None
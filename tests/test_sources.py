@@ -0,0 +1,94 @@
+import json
+
+import requests
+
+import bench
+import sources
+from sources import Source
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def lookup_body(*results):
+    return json.dumps({"resultCount": len(results), "results": list(results)}).encode("utf-8")
+
+
+def test_fetch_json_digs_out_the_version(replay_server):
+    url = 'https://addons.example.com/api/addon/'
+    replay_server({url: (JSON_HEADERS, b'{"current_version": {"version": "8.11.22.27"}}')})
+    source = Source('firefox_stable', 'browser_extension', 'firefox', 'stable', 'json', url,
+                    ('current_version', 'version'))
+
+    assert sources.fetch_json([source], 5) == {'firefox_stable': '8.11.22.27'}
+
+
+def test_fetch_json_reports_an_error_status_rather_than_parsing_the_page(replay_server):
+    replay_server({})
+    source = Source('firefox_stable', 'browser_extension', 'firefox', 'stable', 'json',
+                    'https://addons.example.com/missing/')
+
+    result = sources.fetch_json([source], 5)['firefox_stable']
+
+    assert isinstance(result, requests.HTTPError)
+    assert result.response.status_code == 404
+
+
+def test_fetch_json_keeps_the_storefronts_that_answered(replay_server):
+    url = 'https://store.example.com/detail?gl={REGION}'
+    replay_server({url.format(REGION='US'): (JSON_HEADERS, b'{"version": "8.11.22"}'),
+                   url.format(REGION='GB'): (JSON_HEADERS, b'{"version": "8.11.20"}')})
+    source = Source('edge_stable', 'browser_extension', 'edge', 'stable', 'json', url, regions=('us', 'gb', 'de'))
+
+    result = sources.fetch_json([source], 5)['edge_stable']
+
+    assert result['us'] == '8.11.22'
+    assert result['gb'] == '8.11.20'
+    assert isinstance(result['de'], requests.HTTPError)
+
+
+def test_fetch_app_store_batches_regional_and_plain_lookups(replay_server):
+    lookup = 'https://itunes.apple.com/lookup?id=1,2'
+    replay_server({
+        lookup + '&country=us': (JSON_HEADERS, lookup_body({"trackId": 1, "version": "8.11.22"},
+                                                           {"trackId": 2, "version": "8.11.18"})),
+        lookup + '&country=gb': (JSON_HEADERS, lookup_body({"trackId": 1, "version": "8.11.20"},
+                                                           {"trackId": 2, "version": "8.11.18"})),
+        lookup: (JSON_HEADERS, lookup_body({"trackId": 1, "version": "8.11.22"},
+                                           {"trackId": 2, "version": "8.11.19"})),
+    })
+    regional = Source('safari_stable', 'browser_extension', 'safari', 'stable', 'app_store', 1, regions=('us', 'gb'))
+    plain = Source('opi_stable', 'mobile', 'opi', 'stable', 'app_store', 2)
+
+    assert sources.fetch_app_store([regional, plain], 5) == {
+        'safari_stable': {'us': '8.11.22', 'gb': '8.11.20'},
+        'opi_stable': '8.11.19',
+    }
+
+
+def test_fetch_html_finds_the_version_after_its_label(replay_server):
+    url = 'https://extensions.example.com/detail/abc'
+    page = (b'<html><body>' + b'<p>filler</p>' * 20000
+            + b'<div><div>Version</div><div><span>8.11.22.27</span></div></div></body></html>')
+    replay_server({url: ({"Content-Type": "text/html"}, page)})
+    source = Source('chrome_stable', 'browser_extension', 'chrome', 'stable', 'html', url)
+
+    assert sources.fetch_html([source], 5) == {'chrome_stable': '8.11.22.27'}
+
+
+def test_fetch_repo_index_reads_every_index_and_reuses_unchanged_ones(replay_server, tmp_path):
+    bench.synthetic_fixtures(str(tmp_path), 200)
+    server = replay_server(directories=[str(tmp_path)])
+    members = [source for source in sources.SOURCES if source.fetcher == 'repo_index']
+
+    results, changes = sources.fetch_repo_index(members, 10, {})
+    assert set(results) == {source.id for source in members}
+    assert not any(isinstance(result, Exception) for result in results.values())
+    assert results['opl_deb_stable'].startswith('8.')
+    assert set(changes) == {f"repo_index:{sources._repo_index_batch(source)}" for source in members}
+
+    # With the cache from the first run, only the small checksum files are fetched again
+    served = sum(server.bytes_served.values())
+    again, unchanged = sources.fetch_repo_index(members, 10, changes)
+    assert again == results
+    assert unchanged == {}
+    assert sum(server.bytes_served.values()) - served < 10_000
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import versioning
+
+
+def record(id, version, platform='browser_extension', channel='stable'):
+    return SimpleNamespace(id=id, platform=platform, channel=channel, version=version)
+
+
+def test_build_component_is_not_a_newer_release():
+    assert versioning.parse('dotted', '8.11.22') == versioning.parse('dotted', '8.11.22.27')
+
+
+def test_build_component_does_not_flag_a_three_part_release_as_lagging():
+    standing = versioning.standings([record('chrome_stable', '8.11.22.27'), record('safari_stable', '8.11.22')], {})
+    assert not standing['safari_stable'].lagging
+    assert not standing['chrome_stable'].lagging
+
+
+def test_newer_patch_release_flags_the_older_one():
+    standing = versioning.standings([record('chrome_stable', '8.11.22.27'), record('safari_stable', '8.11.20')], {})
+    assert standing['safari_stable'].lagging
+    assert standing['safari_stable'].latest == '8.11.22.27'
+
+
+def test_missing_components_are_padded():
+    assert versioning.parse('dotted', '8.10') == versioning.parse('dotted', '8.10.0')
+
+
+def test_desktop_build_number_is_ignored():
+    assert versioning.parse('dotted', '8.10.2 (81002012)') == versioning.parse('dotted', '8.10.2')
+
+
+def test_packaging_epoch_and_revision_are_ignored():
+    assert versioning.parse('deb', '1:8.10.2-1') == versioning.parse('rpm', '8.10.2')
+
+
+def test_prerelease_sorts_before_its_release():
+    beta = versioning.parse('deb', '8.10.2~beta.1-1')
+    assert beta < versioning.parse('dotted', '8.10.2')
+    assert beta > versioning.parse('dotted', '8.10.1')
+
+
+def test_prereleases_order_by_build():
+    assert versioning.parse('dotted', '8.10.2-12.BETA') < versioning.parse('dotted', '8.10.2-14.BETA')
+    assert versioning.parse('rpm', '8.10.2~BETA') == versioning.parse('deb', '8.10.2~beta-3')
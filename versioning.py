@@ -0,0 +1,90 @@
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+# Releases compare on major.minor.patch, padded so 8.10 and 8.10.0 compare equal. Any further dotted component is
+# a build number: 8.11.22.27 from an extension store is the same release as 8.11.22 from the App Store.
+RELEASE_PARTS = 3
+
+_NUMBER = re.compile(r'\d+')
+_SUFFIX = re.compile(r'[~\-+ (_]')
+_PRERELEASE = re.compile(r'alpha|beta|rc|pre|dev|nightly', re.IGNORECASE)
+
+
+class VersionKey(NamedTuple):
+    # Sorts the same for every platform: the release numbers, then pre-releases before the release itself, then
+    # pre-releases by their build and whatever numbers follow. Build and packaging numbers on a final release don't
+    # count, so neither 8.10.2 (81002012) nor 8.10.2.27 on one platform makes a plain 8.10.2 elsewhere look behind.
+    release: tuple
+    final: int
+    extra: tuple
+
+
+def _numbers(text):
+    return tuple(int(number) for number in _NUMBER.findall(text))
+
+
+def _upstream(version_format, text):
+    # The part of a version string that means the same thing on every platform. Epochs only order one
+    # distribution's packages, so they're dropped along with the Debian revision.
+    if version_format in ('deb', 'rpm') and ':' in text:
+        text = text.split(':', 1)[1]
+    if version_format == 'deb' and '-' in text:
+        text = text.rsplit('-', 1)[0]
+    return text
+
+
+@lru_cache(maxsize=4096)
+def parse(version_format, text) -> VersionKey:
+    # One key per (format, string), parsed once: store versions (8.10.2), deb (1:8.10.2-1, 8.10.2~beta-1), rpm
+    # (8.10.2, 8.10.2~BETA) and desktop build strings (8.10.2 (81002012), 8.10.2-12.BETA) all come out comparable
+    upstream = _upstream(version_format, text.strip())
+    split = _SUFFIX.search(upstream)
+    release_text, suffix = (upstream[:split.start()], upstream[split.start():]) if split else (upstream, '')
+    numbers = _numbers(release_text)
+    release = numbers[:RELEASE_PARTS]
+    release += (0,) * (RELEASE_PARTS - len(release))
+    # '~' sorts before the release it precedes, in deb and rpm alike
+    if '~' in upstream or _PRERELEASE.search(upstream):
+        return VersionKey(release, 0, numbers[RELEASE_PARTS:] + _numbers(suffix))
+    return VersionKey(release, 1, ())
+
+
+class Standing(NamedTuple):
+    # Where a source's version stands against the newest in its group (same platform and channel)
+    group: tuple
+    latest: str
+    lagging: bool
+
+
+def standings(records, formats) -> dict:
+    # {source id: Standing} for every record with a version, in one pass. `formats` maps source id to its version
+    # format ('deb', 'rpm', anything else is read as a plain dotted version).
+    groups = {}
+    for record in records:
+        if not record.version:
+            continue
+        key = parse(formats.get(record.id, 'dotted'), record.version)
+        groups.setdefault((record.platform, record.channel), []).append((key, record))
+
+    result = {}
+    for group, entries in groups.items():
+        newest_key, newest = max(entries, key=lambda entry: entry[0])
+        for key, record in entries:
+            result[record.id] = Standing(group, newest.version, key < newest_key)
+    return result
+
+
+def matrix(records, standing) -> list:
+    # Latest vs lagging per group, for the API: [{platform, channel, latest, sources: [...]}] in display order
+    groups = {}
+    for record in records:
+        entry = standing.get(record.id)
+        if entry is None:
+            continue
+        group = groups.get(entry.group)
+        if group is None:
+            group = groups[entry.group] = {"platform": entry.group[0], "channel": entry.group[1],
+                                           "latest": entry.latest, "sources": []}
+        group["sources"].append({"id": record.id, "version": record.version, "lagging": entry.lagging})
+    return list(groups.values())